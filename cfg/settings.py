@@ -9,21 +9,172 @@ video_conf_files = list(root.joinpath('video').glob('*.json'))
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
-# Default parameters for face model:
+# A face classifier model is either "knn" (scikit-learn k-nearest neighbors),
+# or "gallery" (exact k-nearest neighbors matching by blocked matrix products,
+# which switches to an approximate IVF index on galleries larger than
+# "ann_min_size" vectors). The gallery matcher compares L2-normalized vectors,
+# so its distances and the tuned threshold differ from the KNN ones, and a
+# model has to be retrained with "-c gallery" to switch to it:
+clf_model = 'knn'
+
+# Default parameters for face models:
 clf_model_params = {
-    'n_neighbors': 5,
-    'weights': 'uniform',
-    'algorithm': 'kd_tree'
+    'knn': {
+        'n_neighbors': 5,
+        'weights': 'uniform',
+        'algorithm': 'kd_tree'
+    },
+    'gallery': {
+        'n_neighbors': 5,
+        'weights': 'uniform',
+        'index': 'auto',
+        'ann_min_size': 100000
+    },
 }
 
-# Parameter grid for model optimization:
+# Parameter grids for model optimization:
 clf_model_param_grid = {
-    'n_neighbors': range(1, 6),
-    'weights': ('uniform', 'distance'),
-    'algorithm': ('ball_tree', 'kd_tree'),
+    'knn': {
+        'n_neighbors': range(1, 6),
+        'weights': ('uniform', 'distance'),
+        'algorithm': ('ball_tree', 'kd_tree'),
+    },
+    'gallery': {
+        'n_neighbors': range(1, 6),
+        'weights': ('uniform', 'distance'),
+    },
 }
 
 clf_unknown_face_label = 'Unknown_Face'
 
+# Keyframe scheduling of face watchers. Full face recognition runs on every
+# N-th frame only, while the frames in between are served by a target tracker.
+# In the adaptive mode, the interval is stretched up to the max value as long
+# as all of the tracked targets are recognized with a high confidence:
+watcher_keyframe_interval = 1
+watcher_keyframe_max_interval = 10
+watcher_keyframe_confidence = 0.8
+
 logger = 'face_id'
 
+
+# A number of worker threads per stage of a staged vision task handler, and
+# a max number of batches waiting between two consecutive stages:
+pipeline_stage_workers = {
+    'detect': 1,
+    'align': 2,
+    'encode': 1,
+    'classify': 1,
+}
+pipeline_queue_size = 4
+
+# Vision task handlers size batches dynamically, so that a batch is expected to
+# be processed within the latency target (sec). If the task queue runs out,
+# handlers wait for more tasks within the micro-batching window (sec):
+batch_latency_target = 0.2
+batch_max_wait = 0.01
+
+# Process-based vision task handlers pass frames to worker processes through
+# shared memory. A slot of the given size (bytes) is reserved per batch item:
+process_frame_slot_size = 1920 * 1080 * 3
+
+# A number of preallocated frame slots per video stream. Can be overridden by
+# the "ring_slots" entry of a video device configuration file:
+video_ring_slots = 8
+
+# Video capture mode, which can be overridden by the "capture" entry of a
+# video device configuration file. In the "sync" mode frames are read from the
+# capture buffer one by one, while in the "latest" mode a grabber thread keeps
+# draining the buffer and only the newest frame is decoded on read. A failed
+# grab is retried after the interval (sec):
+video_capture_mode = 'sync'
+video_grab_retry_interval = 0.01
+# Capture raw MJPEG frames of video devices and decode them on demand, which
+# can be overridden by the "mjpeg" entry of a video device configuration file.
+# Frames which are neither recognized nor shown are never decoded at full
+# resolution, and motion gating decodes them at a reduced scale. Recognized
+# keyframes are still decoded at full resolution, since faces are aligned on
+# them, so the decode cost of keyframes is not reduced:
+video_raw_mjpeg = False
+
+# Running vision task handlers poll the model configuration and classifier
+# files every N seconds, and reload the face classifier once they change:
+model_reload_interval = 5
+
+# Track-level recognition cache. Faces of targets, which have been recognized
+# as the same person over the last N recognitions with a high probability, are
+# not encoded again as long as their boxes do not move abruptly (IoU with the
+# tracked box). Such targets are verified by full recognition every M
+# keyframes:
+track_cache_min_votes = 10
+track_cache_confidence = 0.8
+track_cache_iou = 0.5
+track_cache_verify_interval = 30
+
+# Motion-predicted ROI detection. Between full-frame sweeps (every N
+# keyframes), faces are detected in square regions around predicted locations
+# of the tracked targets only. The regions are enlarged by the margin (relative
+# to the box size), and resized to the same size to be detected in batches:
+roi_sweep_interval = 5
+roi_margin = 0.5
+roi_size = 200
+
+# Person-gated face detection. Faces are searched for within the upper part
+# of each detected person box (relative to the box height):
+person_face_region = 0.4
+
+# Pipeline metrics are served in the Prometheus text format on this host once
+# a metrics port is given. Camera FPS is measured over the interval (sec):
+metrics_host = '127.0.0.1'
+metrics_fps_interval = 5
+
+# Sampling profiler. Stacks of the pipeline threads (matched by name prefixes)
+# are sampled at the interval (sec) for at most the max duration (sec), and
+# dumped to the output directory as collapsed stacks and pstats:
+profiler_interval = 0.005
+profiler_max_duration = 60
+profiler_threads = ('FaceWatcher', 'VisionTaskHandler', 'PipelineStage')
+profiler_output_dir = 'profiles'
+
+# Default face detection scale settings, which can be overridden by the
+# "detection" entry of a video device configuration file. Frames are
+# downscaled by the factor before detection and upsampled by the detector the
+# given number of times. Faces smaller than the min size (pixels of the
+# original frame) are ignored:
+face_detection = {
+    'downscale': 1,
+    'upsample': 1,
+    'min_face_size': 0,
+}
+
+# Default motion gating settings, which can be overridden by the "motion"
+# entry of a video device configuration file. Frames are not recognized while
+# less than 1 - sensitivity of their pixels change, but at least every
+# max_skip frames:
+motion_detection = {
+    'enabled': False,
+    'sensitivity': 0.99,
+    'max_skip': 30,
+}
+# Motion is detected on grayscale frames downscaled to the given width. Pixels
+# differing from the running average background by more than the delta are
+# counted as changed:
+motion_frame_width = 160
+motion_pixel_delta = 25
+motion_background_rate = 0.1
+
+# Face detector cascade. The cheap dlib HOG detector screens frames first, and
+# its results scored above the high threshold are accepted. The CNN detector
+# runs on frames where HOG finds uncertain candidates (scored between the low
+# and high thresholds), either on whole frames ("frame" policy), or on regions
+# around the candidates ("region" policy). The CNN detector also runs on every
+# N-th frame to measure the HOG recall, which is logged with other cascade
+# stats every M frames:
+face_cascade = {
+    'enabled': False,
+    'policy': 'frame',
+    'low_score': -0.5,
+    'high_score': 0.5,
+    'cnn_interval': 30,
+    'stats_interval': 1000,
+}
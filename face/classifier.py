@@ -10,11 +10,13 @@ from sklearn.metrics import matthews_corrcoef, classification_report
 
 from cfg import settings
 from .model import builder, optimizer
+from .store import EmbeddingStore
 
 
 class FaceClassifier:
 
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, model_name=None):
+        self.model_name = model_name or settings.clf_model
         self.model = self.load(model_path)
 
     @property
@@ -22,6 +24,13 @@ class FaceClassifier:
         return logging.getLogger(settings.logger)
 
     def get_faces(self, path):
+        store = EmbeddingStore(path)
+
+        if store.exists() and len(store):
+            self.log.info(f'Load face vectors from the store in {path}')
+
+            return store.load()
+
         self.log.info(f'Load face vectors from {path}')
         vecs, names = [], []
 
@@ -59,8 +68,9 @@ class FaceClassifier:
 
         if optimize:
             self.log.info('Start optimization of model parameters...')
+            param_grid = settings.clf_model_param_grid[self.model_name]
             params = optimizer.optimize_params(
-                self.model, X_train, y_train, settings.clf_model_param_grid)
+                self.model, X_train, y_train, param_grid)
             self.log.info(f'Best params: {params}')
             self.model.set_params(**params)
 
@@ -79,6 +89,21 @@ class FaceClassifier:
 
         self.log.info(f'Done. Best threshold: {self.model.threshold:.2f}')
 
+    def enroll(self, face_vecs, labels, face_db):
+        # Add faces to the trained model keeping the tuned threshold. The
+        # gallery matcher appends them to its gallery, while other models are
+        # refitted on all faces of the face database, which already has the
+        # new ones.
+        self.log.info(f'Enroll {len(face_vecs)} face vectors '
+                      f'of {len(set(labels))} person(s)')
+
+        if hasattr(self.model, 'partial_fit'):
+            self.model.partial_fit(face_vecs, labels)
+            return
+
+        X, y = self.get_faces(face_db)
+        self.model.fit(X, y)
+
     def find_best_threshold(self, probas, y_true):
         min_thres = 1 / len(self.model.classes_)
         thresholds = np.arange(min_thres, 1.0, 0.01)[::-1]
@@ -124,13 +149,19 @@ class FaceClassifier:
 
     def save(self, model_path):
         self.log.info(f'Save a face recognizer model to {model_path}')
-        joblib.dump(self.model, model_path)
+        # Replace the model file atomically, since it may be watched and
+        # reloaded by a running service.
+        tmp_path = f'{model_path}.tmp'
+        joblib.dump(self.model, tmp_path)
+        os.replace(tmp_path, model_path)
 
     def load(self, model_path=None):
 
         if model_path is None:
-            self.log.info('Build a new face recognizer model...')
-            model = builder.build_model(settings.clf_model_params)
+            self.log.info(f'Build a new {self.model_name} face recognizer '
+                          f'model...')
+            params = settings.clf_model_params[self.model_name]
+            model = builder.build_model(params, self.model_name)
         else:
             self.log.info(f'Load a face recognizer model from {model_path}')
             model = joblib.load(model_path)
@@ -1,32 +1,267 @@
 import logging
+from collections import Counter, defaultdict, namedtuple
 
+import cv2
 import dlib
-import numpy as np
 
 from cfg import settings
+from tracker.utils import box_iou
 
 
 log = logging.getLogger(settings.logger)
 
+FaceDetection = namedtuple('FaceDetection', ['rect', 'confidence'])
+
 
 class FaceDetector:
 
-    def __init__(self, model_path):
+    def __init__(self, model_path, cascade=None):
         log.info(f'Load a face detector from {model_path}')
         self.detector = dlib.cnn_face_detection_model_v1(model_path)
+        self.cascade = cascade or settings.face_cascade
+        self.cascade_stats = Counter()
+        self.cascade_logged = 0
+
+        if self.cascade['enabled']:
+            log.info('Load a HOG face detector for the detector cascade')
+            self.hog_detector = dlib.get_frontal_face_detector()
+
+    def detect(self, images, batch_size=32, upsample=1, downscale=1):
+
+        if downscale != 1:
+            # Detect faces on downscaled images, and map them back to the
+            # original image coordinates.
+            images = [self.resize(img, 1 / downscale) for img in images]
+            face_dets = self.detect(images, batch_size, upsample)
+
+            return [[self.scale(d, downscale, downscale) for d in dets]
+                    for dets in face_dets]
+
+        if self.cascade['enabled']:
+            return self.detect_cascade(images, batch_size, upsample)
+
+        return self.detect_cnn(images, batch_size, upsample)
+
+    def detect_cascade(self, images, batch_size=32, upsample=1):
+        # The cheap HOG detector screens images first. Its confident results
+        # are accepted as is, while the CNN detector is run on images (or
+        # regions of images) where HOG finds uncertain candidates, as well as
+        # on every N-th image to measure how many faces HOG misses.
+        low, high = self.cascade['low_score'], self.cascade['high_score']
+        face_dets = [None] * len(images)
+        hog_dets = [None] * len(images)
+        cnn_full, cnn_regions = [], []
+
+        for i, img in enumerate(images):
+            self.cascade_stats['frames'] += 1
+            rects, scores, _ = self.hog_detector.run(img, upsample, low)
+            confident = [FaceDetection(r, s)
+                         for r, s in zip(rects, scores) if s >= high]
+            uncertain = [r for r, s in zip(rects, scores) if s < high]
+            periodic = (self.cascade_stats['frames']
+                        % self.cascade['cnn_interval'] == 0)
+
+            if periodic:
+                self.cascade_stats['cnn_periodic'] += 1
+                hog_dets[i] = confident
+                cnn_full.append(i)
+            elif not uncertain:
+                self.cascade_stats['hog_accepted'] += 1
+                face_dets[i] = confident
+            elif self.cascade['policy'] == 'region':
+                self.cascade_stats['cnn_regions'] += 1
+                face_dets[i] = confident
+                cnn_regions.append((i, self.enlarge(img, uncertain)))
+            else:
+                self.cascade_stats['cnn_frames'] += 1
+                cnn_full.append(i)
+
+        if cnn_full:
+            dets = self.detect_cnn([images[i] for i in cnn_full], batch_size,
+                                   upsample)
+
+            for i, d in zip(cnn_full, dets):
+                face_dets[i] = d
+
+                if hog_dets[i] is not None:
+                    self.compare(hog_dets[i], d)
+
+        if cnn_regions:
+            indices, rois = zip(*cnn_regions)
+            dets = self.detect_rois([images[i] for i in indices], rois,
+                                    batch_size, upsample)
+
+            for i, d in zip(indices, dets):
+                face_dets[i] = self.suppress(face_dets[i] + d)
+
+        self.log_cascade_stats()
+
+        return face_dets
+
+    def enlarge(self, img, rects, margin=0.5):
+        h, w = img.shape[:2]
+        rois = []
+
+        for r in rects:
+            size = max(r.width(), r.height()) * (1 + 2 * margin)
+            cx, cy = r.center().x, r.center().y
+            rois.append([
+                max(0, int(cx - size / 2)),
+                max(0, int(cy - size / 2)),
+                min(w, int(cx + size / 2)),
+                min(h, int(cy + size / 2)),
+            ])
+
+        return rois
+
+    def compare(self, hog_dets, cnn_dets, iou_thres=0.3):
+        # Faces found by the CNN detector are considered the ground truth for
+        # the HOG detector on periodic checks. Faces are matched one to one,
+        # so a HOG face is not counted as a hit of several CNN faces.
+        hog_boxes = [self.rect_to_list(d.rect) for d in hog_dets]
+        unmatched = set(range(len(hog_boxes)))
+
+        for d in cnn_dets:
+            box = self.rect_to_list(d.rect)
+            ious = {j: box_iou(box, hog_boxes[j]) for j in unmatched}
+            best = max(ious, key=ious.get, default=None)
+
+            if best is not None and ious[best] >= iou_thres:
+                self.cascade_stats['hog_hits'] += 1
+                unmatched.remove(best)
+            else:
+                self.cascade_stats['hog_misses'] += 1
+
+        self.cascade_stats['hog_false_alarms'] += len(unmatched)
+
+    def log_cascade_stats(self):
+        stats = self.cascade_stats
+        frames = stats['frames']
+
+        # Frames are counted per batch, so the count may step over the exact
+        # multiples of the interval.
+        if frames - self.cascade_logged < self.cascade['stats_interval']:
+            return
+
+        self.cascade_logged = frames
 
-    def detect(self, images, batch_size=32, upsample=1):
-        batches = round(len(images) / batch_size) or 1
-        face_dets = []
+        cnn_frames = stats['cnn_frames'] + stats['cnn_periodic']
+        faces = stats['hog_hits'] + stats['hog_misses']
+        recall = stats['hog_hits'] / faces if faces else 1.0
+        log.info(f'Detector cascade: {frames} frames, '
+                 f'{stats["hog_accepted"] / frames:.1%} accepted by HOG, '
+                 f'{cnn_frames / frames:.1%} CNN frames, '
+                 f'{stats["cnn_regions"] / frames:.1%} CNN regions, '
+                 f'HOG recall {recall:.1%}, '
+                 f'{stats["hog_false_alarms"]} HOG false alarms')
 
-        for i in range(batches):
-            batch_start = i * batch_size
-            batch_end = (i + 1) * batch_size
-            batch = images[batch_start:batch_end]
-            det = self.detector(batch, upsample)
-            face_dets.append(det)
+    def detect_cnn(self, images, batch_size=32, upsample=1):
+        # Images of a detector batch must be of the same size, so they are
+        # grouped by shape first.
+        groups = defaultdict(list)
 
-        return np.concatenate(face_dets)
+        for i, img in enumerate(images):
+            groups[img.shape].append(i)
+
+        face_dets = [None] * len(images)
+
+        for indices in groups.values():
+
+            for batch_start in range(0, len(indices), batch_size):
+                batch_indices = indices[batch_start:batch_start + batch_size]
+                batch = [images[i] for i in batch_indices]
+                dets = self.detector(batch, upsample)
+
+                for i, img_dets in zip(batch_indices, dets):
+                    face_dets[i] = [
+                        FaceDetection(d.rect, d.confidence) for d in img_dets
+                    ]
+
+        return face_dets
+
+    def detect_rois(self, images, rois, batch_size=32, upsample=1):
+        # Crop regions of interest and resize them to the same size, so that
+        # crops of all the images are detected in batches.
+        size = settings.roi_size
+        crops, origins = [], []
+
+        for i, (img, img_rois) in enumerate(zip(images, rois)):
+            img_h, img_w = img.shape[:2]
+
+            for roi in img_rois:
+                xmin, ymin, xmax, ymax = self.square(roi, img_w, img_h)
+                crop = img[ymin:ymax, xmin:xmax]
+
+                if not crop.size:
+                    continue
+
+                crops.append(cv2.resize(crop, (size, size)))
+                scale = ((xmax - xmin) / size, (ymax - ymin) / size)
+                origins.append((i, xmin, ymin, scale))
+
+        crop_dets = []
+
+        if crops:
+            crop_dets = self.detect_cnn(crops, batch_size, upsample)
+
+        face_dets = [[] for _ in images]
+
+        # Map detected faces back to the image coordinates:
+        for (i, xmin, ymin, (sx, sy)), dets in zip(origins, crop_dets):
+            face_dets[i].extend(
+                self.scale(d, sx, sy, xmin, ymin) for d in dets)
+
+        return [self.suppress(dets) for dets in face_dets]
+
+    def square(self, roi, img_w, img_h):
+        # Regions are made square around their centers, so that faces are not
+        # distorted by resizing, and clipped to the image bounds.
+        xmin, ymin, xmax, ymax = roi
+        size = max(xmax - xmin, ymax - ymin)
+        xmin = (xmin + xmax - size) // 2
+        ymin = (ymin + ymax - size) // 2
+
+        return [
+            max(0, xmin),
+            max(0, ymin),
+            min(img_w, xmin + size),
+            min(img_h, ymin + size),
+        ]
+
+    def resize(self, img, scale):
+        h, w = img.shape[:2]
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+
+        return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+    def scale(self, det, sx, sy, xmin=0, ymin=0):
+        box = [
+            xmin + round(det.rect.left() * sx),
+            ymin + round(det.rect.top() * sy),
+            xmin + round(det.rect.right() * sx),
+            ymin + round(det.rect.bottom() * sy),
+        ]
+
+        return FaceDetection(self.list_to_rect(box), det.confidence)
+
+    def filter_size(self, dets, min_size):
+        return [d for d in dets
+                if min(d.rect.width(), d.rect.height()) >= min_size]
+
+    def suppress(self, dets, iou_thres=0.5):
+        # Regions of interest may overlap, so keep the most confident one of
+        # overlapping faces.
+        dets = sorted(dets, key=lambda d: d.confidence, reverse=True)
+        kept = []
+
+        for d in dets:
+            box = self.rect_to_list(d.rect)
+
+            if all(box_iou(box, self.rect_to_list(k.rect)) < iou_thres
+                   for k in kept):
+                kept.append(d)
+
+        return kept
 
     def rect_to_list(self, rect):
         return [rect.left(), rect.top(), rect.right(), rect.bottom()]
@@ -35,4 +270,3 @@ class FaceDetector:
         xmin, ymin, xmax, ymax = box
 
         return dlib.rectangle(left=xmin, top=ymin, right=xmax, bottom=ymax)
-
@@ -16,13 +16,10 @@ class FaceEncoder:
         self.encoder = dlib.face_recognition_model_v1(model_path)
 
     def encode(self, faces, batch_size=32):
-        batches = round(len(faces) / batch_size) or 1
         face_vecs = []
 
-        for i in range(batches):
-            batch_start = i * batch_size
-            batch_end = (i + 1) * batch_size
-            batch = faces[batch_start:batch_end]
+        for batch_start in range(0, len(faces), batch_size):
+            batch = faces[batch_start:batch_start + batch_size]
             desc = self.encoder.compute_face_descriptor(batch)
             face_vecs.append(desc)
 
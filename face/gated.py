@@ -0,0 +1,36 @@
+from cfg import settings
+from person.detector import PersonDetector
+from .recognizer import FaceRecognizer
+
+
+class PersonGatedRecognizer(FaceRecognizer):
+
+    def load_models(self):
+        super().load_models()
+        self.person_detector = PersonDetector()
+
+    def face_region(self, box):
+        # A face is expected in the upper part of a person box:
+        xmin, ymin, xmax, ymax = box
+        height = round((ymax - ymin) * settings.person_face_region)
+
+        return [xmin, ymin, xmax, ymin + height]
+
+    def detect_faces(self, state):
+        # Persons are detected first, and faces are only searched for within
+        # the upper parts of the detected persons. Images without persons
+        # are not passed to the face detector at all. Regions of interest of
+        # the tracked targets are still searched as well.
+        images = state['images']
+        rois = state.get('rois') or [None] * len(images)
+        persons = self.person_detector.predict(images,
+                                               state.get('batch_size', 32))
+        person_rois = []
+
+        for img_persons, img_rois in zip(persons, rois):
+            regions = [self.face_region(p['box']) for p in img_persons]
+            person_rois.append(regions + (img_rois or []))
+
+        state['rois'] = person_rois
+
+        return super().detect_faces(state)
@@ -0,0 +1,224 @@
+import os
+import json
+import logging
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from cfg import settings
+from .recognizer import FaceRecognizer
+from .store import EmbeddingStore
+
+
+class FaceIngestor:
+
+    MANIFEST_FILE = 'manifest.jsonl'
+
+    def __init__(self, facedb, workers=4, batch_size=32):
+        self.facedb = facedb
+        self.workers = workers
+        self.batch_size = batch_size
+        self.recognizer = FaceRecognizer()
+        self.store = EmbeddingStore(facedb)
+        self.manifest_file = os.path.join(facedb, self.MANIFEST_FILE)
+        self._manifest_lock = Lock()
+
+    @property
+    def log(self):
+        return logging.getLogger(settings.logger)
+
+    def reset(self):
+        self.store.clear()
+
+        if os.path.exists(self.manifest_file):
+            os.remove(self.manifest_file)
+
+    def load_manifest(self):
+        processed = set()
+
+        if not os.path.exists(self.manifest_file):
+            return processed
+
+        with open(self.manifest_file) as f:
+
+            for line in f:
+
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line may be incomplete after an interruption.
+                    continue
+
+                # Images which failed to decode, e.g. due to a temporary I/O
+                # error, are retried by the next run.
+                if entry['status'] == 'error':
+                    continue
+
+                processed.add(os.path.join(self.facedb, entry['file']))
+
+        return processed
+
+    def record(self, img_file, status):
+        entry = {
+            'file': os.path.relpath(img_file, self.facedb),
+            'status': status,
+        }
+
+        with self._manifest_lock:
+
+            with open(self.manifest_file, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def bootstrap(self):
+        # Embeddings of a database which predates the store are imported.
+        if not self.store.exists():
+            self.store.import_npy(self.facedb)
+
+    def encoded(self):
+        return {os.path.splitext(f)[0] for f in self.store.sources()}
+
+    def find_images(self, force=False):
+
+        # Legacy embeddings are not imported if all of the images are forced
+        # to be encoded again.
+        if not force:
+            self.bootstrap()
+
+        # Images are skipped if they already have embeddings in the store, or
+        # were processed by a previous (possibly interrupted) run.
+        encoded = self.encoded()
+        processed = self.load_manifest()
+
+        input_files = [os.path.join(self.facedb, f)
+                       for f in os.listdir(self.facedb)]
+        dirnames = [f for f in input_files if os.path.isdir(f)]
+        n = len(dirnames)
+
+        self.log.info(f'Inspecting the face database {self.facedb}')
+        images = []
+
+        for i, dirname in enumerate(dirnames, start=1):
+            self.log.info(f'[{i}/{n}] {dirname}')
+
+            files = [os.path.join(dirname, f) for f in os.listdir(dirname)]
+            img_files = [
+                f for f in files if f.endswith('.jpg') and 'aligned' not in f]
+
+            if not img_files:
+                self.log.warning('No images found.')
+                continue
+
+            for f in img_files:
+                name = os.path.splitext(f)[0]
+
+                if name not in encoded and f not in processed:
+                    images.append(f)
+
+        return images
+
+    def decode(self, img_file):
+
+        try:
+            return np.array(Image.open(img_file).convert('RGB'))
+        except Exception as e:
+            self.log.warning(f'Failed to decode {img_file}: {e}')
+
+    def write(self, img_file, face_img, face_emb):
+        img_dir = os.path.dirname(img_file)
+        basename = os.path.basename(img_file)
+        name, ext = os.path.splitext(basename)
+
+        try:
+            face_img_file = os.path.join(img_dir, f'{name}_aligned{ext}')
+            Image.fromarray(face_img).save(face_img_file)
+
+            face_emb_file = os.path.join(img_dir, f'{name}.npy')
+            np.save(face_emb_file, face_emb)
+        except Exception as e:
+            self.log.warning(f'Failed to write faces of {img_file}: {e}')
+
+        self.record(img_file, 'encoded')
+
+    def process(self, img_files, images, writer):
+        decoded = [(f, img) for f, img in zip(img_files, images)
+                   if img is not None]
+
+        for f, img in zip(img_files, images):
+
+            if img is None:
+                self.record(f, 'error')
+
+        if not decoded:
+            return
+
+        img_files, images = zip(*decoded)
+        face_files, face_imgs = [], []
+
+        face_dets = self.recognizer.detector.detect(images, self.batch_size)
+
+        for img_file, img, dets in zip(img_files, images, face_dets):
+
+            if not len(dets):
+                self.log.warning(f'No faces found in {img_file}')
+                self.record(img_file, 'no_face')
+                continue
+
+            face_img = self.recognizer.aligner.align(img, dets[0])
+            face_files.append(img_file)
+            face_imgs.append(face_img)
+
+        if not face_imgs:
+            return
+
+        face_embs = self.recognizer.encoder.encode(face_imgs, self.batch_size)
+        labels = [os.path.basename(os.path.dirname(f)) for f in face_files]
+        self.store.append(face_embs, labels, face_files)
+
+        for img_file, face_img, face_emb in zip(face_files, face_imgs,
+                                                face_embs):
+            writer.submit(self.write, img_file, face_img, face_emb)
+
+    def run(self, force=False, img_files=None):
+
+        if force:
+            self.reset()
+
+        if img_files is None:
+            img_files = self.find_images(force)
+        elif not force:
+            # Given images which already have embeddings are not added again.
+            encoded = self.encoded()
+            img_files = [f for f in img_files
+                         if os.path.splitext(f)[0] not in encoded]
+
+        if not img_files:
+            return
+
+        n = len(img_files)
+        self.log.info(f'Found {n} images for processing.')
+        batches = [img_files[i:i + self.batch_size]
+                   for i in range(0, n, self.batch_size)]
+
+        # Images are decoded by a pool of workers one batch ahead of the
+        # batch being detected and encoded, while aligned faces and embeddings
+        # are written to files in the background.
+        with ThreadPoolExecutor(self.workers) as decoder, \
+                ThreadPoolExecutor(1) as writer:
+            decoding = [decoder.submit(self.decode, f) for f in batches[0]]
+            done = 0
+
+            for i, batch in enumerate(batches):
+                images = [d.result() for d in decoding]
+
+                if i + 1 < len(batches):
+                    decoding = [decoder.submit(self.decode, f)
+                                for f in batches[i + 1]]
+
+                self.process(batch, images, writer)
+                done += len(batch)
+                self.log.info(f'[{done}/{n}] Processed images.')
+
+        self.log.info(f'Done. The store has {len(self.store)} '
+                      f'face embeddings.')
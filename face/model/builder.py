@@ -1,11 +1,22 @@
 from sklearn.neighbors import KNeighborsClassifier
 
+from .matcher import GalleryMatcher
 
-def build_model(params=None):
-    model = KNeighborsClassifier()
+
+MODELS = {
+    'knn': KNeighborsClassifier,
+    'gallery': GalleryMatcher,
+}
+
+
+def build_model(params=None, name='knn'):
+
+    try:
+        model = MODELS[name]()
+    except KeyError:
+        raise ValueError(f'Unknown face classifier model: {name}')
 
     if params is not None:
         model.set_params(**params)
 
     return model
-
@@ -0,0 +1,202 @@
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+
+
+def normalize(X):
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+
+    return X / np.maximum(norms, 1e-12)
+
+
+def top_k(sims, k):
+    # Select indices of k largest similarities per row, sorted descending.
+    k = min(k, sims.shape[1])
+    indices = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    top_sims = np.take_along_axis(sims, indices, axis=1)
+    order = np.argsort(-top_sims, axis=1)
+
+    return (np.take_along_axis(top_sims, order, axis=1),
+            np.take_along_axis(indices, order, axis=1))
+
+
+class GalleryMatcher(BaseEstimator, ClassifierMixin):
+
+    def __init__(self, n_neighbors=5, weights='uniform', index='auto',
+                 block_size=65536, ann_min_size=100000, n_lists=None,
+                 n_probe=16, n_iter=10):
+        self.n_neighbors = n_neighbors
+        self.weights = weights
+        self.index = index
+        self.block_size = block_size
+        self.ann_min_size = ann_min_size
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+
+    def fit(self, X, y):
+        self.gallery_ = normalize(X)
+        self.classes_, self.labels_ = np.unique(y, return_inverse=True)
+        self.build_index()
+
+        return self
+
+    def partial_fit(self, X, y):
+        # Append new vectors to the gallery. Labels are re-encoded, since new
+        # classes may appear in between of the known ones.
+        classes = np.union1d(self.classes_, y)
+        labels = np.searchsorted(classes, self.classes_[self.labels_])
+        new_labels = np.searchsorted(classes, y)
+        n = len(self.gallery_)
+
+        self.gallery_ = np.vstack([self.gallery_, normalize(X)])
+        self.classes_ = classes
+        self.labels_ = np.concatenate([labels, new_labels])
+
+        if self.centroids_ is None:
+            self.build_index()
+        else:
+            # Add new vectors to the closest lists of the existing index.
+            lists = np.empty(len(self.gallery_), dtype=np.int64)
+            lists[self.list_order_] = np.repeat(
+                np.arange(len(self.centroids_)), np.diff(self.list_offsets_))
+            lists[n:] = self.nearest_centroids(self.gallery_[n:],
+                                               self.centroids_)
+            self.list_order_ = np.argsort(lists, kind='stable')
+            self.list_offsets_ = np.searchsorted(
+                lists[self.list_order_], np.arange(len(self.centroids_) + 1))
+
+        return self
+
+    def build_index(self):
+        n = len(self.gallery_)
+        use_ann = self.index == 'ivf' or (
+            self.index == 'auto' and n >= self.ann_min_size)
+
+        if not use_ann:
+            self.centroids_ = None
+            return
+
+        # Build an inverted file index: gallery vectors are clustered by the
+        # spherical k-means, and a query is matched against members of a few
+        # closest clusters only.
+        n_lists = min(n, self.n_lists or int(4 * np.sqrt(n)))
+        rng = np.random.RandomState(0)
+        sample = self.gallery_[rng.choice(n, min(n, 256 * n_lists), False)]
+        centroids = sample[rng.choice(len(sample), n_lists, False)]
+
+        for _ in range(self.n_iter):
+            assigned = self.nearest_centroids(sample, centroids)
+
+            for i in range(n_lists):
+                members = sample[assigned == i]
+
+                if len(members):
+                    centroids[i] = members.sum(axis=0)
+
+            centroids = normalize(centroids)
+
+        assigned = self.nearest_centroids(self.gallery_, centroids)
+        self.centroids_ = centroids
+        self.list_order_ = np.argsort(assigned, kind='stable')
+        self.list_offsets_ = np.searchsorted(assigned[self.list_order_],
+                                             np.arange(n_lists + 1))
+
+    def nearest_centroids(self, X, centroids):
+        assigned = np.empty(len(X), dtype=np.int64)
+
+        for start in range(0, len(X), self.block_size):
+            block = X[start:start + self.block_size]
+            assigned[start:start + len(block)] = (
+                block @ centroids.T).argmax(axis=1)
+
+        return assigned
+
+    def exact_neighbors(self, X, k):
+        # Match queries against the gallery block by block, so the similarity
+        # matrix never exceeds the block size, and merge top candidates.
+        best_sims = np.full((len(X), 0), -np.inf, dtype=np.float32)
+        best_indices = np.zeros((len(X), 0), dtype=np.int64)
+
+        for start in range(0, len(self.gallery_), self.block_size):
+            block = self.gallery_[start:start + self.block_size]
+            sims, indices = top_k(X @ block.T, k)
+            sims = np.hstack([best_sims, sims])
+            indices = np.hstack([best_indices, indices + start])
+            best_sims, order = top_k(sims, k)
+            best_indices = np.take_along_axis(indices, order, axis=1)
+
+        return best_sims, best_indices
+
+    def ann_neighbors(self, X, k):
+        n_probe = min(self.n_probe, len(self.centroids_))
+        _, lists = top_k(X @ self.centroids_.T, n_probe)
+        best_sims = np.full((len(X), k), -np.inf, dtype=np.float32)
+        best_indices = np.zeros((len(X), k), dtype=np.int64)
+
+        for i, (x, probe) in enumerate(zip(X, lists)):
+            offsets = self.list_offsets_
+            candidates = np.concatenate([
+                self.list_order_[offsets[l]:offsets[l + 1]] for l in probe
+            ])
+
+            if not len(candidates):
+                continue
+
+            sims, indices = top_k(x[None, :] @ self.gallery_[candidates].T, k)
+            best_sims[i, :sims.shape[1]] = sims[0]
+            best_indices[i, :indices.shape[1]] = candidates[indices[0]]
+
+        return best_sims, best_indices
+
+    def kneighbors(self, X, n_neighbors=None):
+        X = normalize(X)
+        k = min(n_neighbors or self.n_neighbors, len(self.gallery_))
+
+        if self.centroids_ is None:
+            sims, indices = self.exact_neighbors(X, k)
+        else:
+            sims, indices = self.ann_neighbors(X, k)
+
+        # Distances to the found neighbors are computed directly in float64,
+        # since ones derived from float32 similarities are never exactly
+        # zero for duplicates, which then are not treated as exact matches.
+        neighbors = self.gallery_[indices].astype(np.float64)
+        dists = np.linalg.norm(X[:, None, :] - neighbors, axis=2)
+        dists[~np.isfinite(sims)] = np.inf
+
+        return dists, indices
+
+    def predict_proba(self, X):
+        dists, indices = self.kneighbors(X)
+        labels = self.labels_[indices]
+
+        # Neighbors which are not found by the approximate search are padded
+        # with infinite distances.
+        found = np.isfinite(dists)
+
+        if self.weights == 'distance':
+            # As in scikit-learn, exact matches outweigh any other neighbors.
+            with np.errstate(divide='ignore'):
+                weights = 1 / dists
+
+            exact = np.isinf(weights)
+            rows = exact.any(axis=1)
+            weights[rows] = exact[rows]
+        else:
+            weights = np.ones_like(dists)
+
+        weights[~found] = 0
+        probas = np.zeros((len(X), len(self.classes_)))
+
+        for j in range(labels.shape[1]):
+            np.add.at(probas, (np.arange(len(X)), labels[:, j]), weights[:, j])
+
+        probas /= np.maximum(probas.sum(axis=1, keepdims=True), 1e-12)
+
+        return probas
+
+    def predict(self, X):
+        probas = self.predict_proba(X)
+
+        return self.classes_.take(probas.argmax(axis=1))
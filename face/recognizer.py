@@ -1,8 +1,11 @@
-import os
 import json
+import time
+import logging
+from collections import defaultdict
 
 from cfg import settings
-from vision.predictor.abc import Predictor
+from tracker.utils import box_iou
+from vision.predictor.abc import Predictor, STAGE_LATENCY
 from .aligner import FaceAligner
 from .classifier import FaceClassifier
 from .detector import FaceDetector
@@ -11,46 +14,200 @@ from .encoder import FaceEncoder
 
 class FaceRecognizer(Predictor):
 
+    # The dlib face detector and encoder networks keep intermediate tensors
+    # between calls, so they cannot be shared by concurrent workers:
+    EXCLUSIVE_STAGES = ('detect', 'encode')
+
     def __init__(self):
         self.load_models()
 
-    def load_models(self):
-        pwd = os.getcwd()
-        os.chdir(settings.model_conf_file.parent)
+    @property
+    def log(self):
+        return logging.getLogger(settings.logger)
+
+    def load_config(self):
 
         with open(settings.model_conf_file) as f:
             cfg = json.load(f)
 
+        # Model paths are relative to the model configuration file:
+        root = settings.model_conf_file.parent
+
+        return {name: str(root.joinpath(path)) for name, path in cfg.items()}
+
+    def load_models(self):
+        cfg = self.load_config()
+
         self.aligner = FaceAligner(cfg['face_shape_predictor'])
         self.detector = FaceDetector(cfg['face_detector'])
         self.encoder = FaceEncoder(cfg['face_encoder'])
         self.clf = FaceClassifier(cfg['face_classifier'])
 
-        os.chdir(pwd)
+    def model_files(self):
+        cfg = self.load_config()
 
-    def predict(self, images, batch_size=32, threshold=None):
-        faces = []
-        face_dets = self.detector.detect(images, batch_size)
+        return [str(settings.model_conf_file), cfg['face_classifier']]
 
-        for img, dets in zip(images, face_dets):
+    def reload(self):
+        # A new classifier is loaded aside and then swapped in at once. Each
+        # batch refers to the classifier only once, so a batch is never
+        # handled by two different classifiers.
+        cfg = self.load_config()
+        self.clf = FaceClassifier(cfg['face_classifier'])
+        self.log.info('Face classifier has been reloaded.')
+
+    def stages(self):
+        return [
+            ('detect', self.detect_faces),
+            ('align', self.align_faces),
+            ('encode', self.encode_faces),
+            ('classify', self.classify_faces),
+        ]
+
+    def predict(self, images, batch_size=32, threshold=None, **params):
+        # Batch params of tasks, e.g. hints, rois or detection settings, are
+        # passed to the stages in the state, as done by a staged pipeline.
+        state = {
+            'images': images,
+            'batch_size': batch_size,
+            'threshold': threshold,
+            **params,
+        }
+
+        for name, stage in self.stages():
+            start = time.monotonic()
+            state = stage(state)
+            STAGE_LATENCY.observe(time.monotonic() - start, stage=name)
+
+        return state['predictions']
+
+    def detect_faces(self, state):
+        # Images which come with regions of interest are only searched for
+        # faces within these regions. Images of the same detection scale
+        # settings are detected together.
+        batch_size = state.get('batch_size', 32)
+        images = state['images']
+        rois = state.get('rois') or [None] * len(images)
+        scales = state.get('detection') or [None] * len(images)
+        groups = defaultdict(list)
+
+        for i, (r, scale) in enumerate(zip(rois, scales)):
+            scale = {**settings.face_detection, **(scale or {})}
+            key = (r is not None, scale['downscale'], scale['upsample'])
+            groups[key].append(i)
+
+        face_dets = [None] * len(images)
+
+        for (partial, downscale, upsample), indices in groups.items():
+            group = [images[i] for i in indices]
+
+            if partial:
+                dets = self.detector.detect_rois(
+                    group, [rois[i] for i in indices], batch_size, upsample)
+            else:
+                dets = self.detector.detect(group, batch_size, upsample,
+                                            downscale)
+
+            for i, d in zip(indices, dets):
+                face_dets[i] = d
+
+        # Boxes are in the original image coordinates, so the alignment
+        # still uses full-resolution pixels.
+        for i, scale in enumerate(scales):
+            min_size = (scale or {}).get(
+                'min_face_size', settings.face_detection['min_face_size'])
+
+            if min_size:
+                face_dets[i] = self.detector.filter_size(face_dets[i],
+                                                         min_size)
+
+        state['dets'] = face_dets
+
+        return state
+
+    def match_hints(self, dets, hints):
+        # Match detected faces with cached targets by the best overlap of
+        # their boxes. A face which has moved abruptly is recognized again.
+        cached = {}
+
+        for hint in hints or []:
+            best_i, best_iou = None, settings.track_cache_iou
+
+            for i, det in enumerate(dets):
+
+                if i in cached:
+                    continue
+
+                box = self.detector.rect_to_list(det.rect)
+                iou = box_iou(box, hint['box'])
+
+                if iou >= best_iou:
+                    best_i, best_iou = i, iou
+
+            if best_i is not None:
+                cached[best_i] = hint
+
+        return cached
+
+    def align_faces(self, state):
+        hints = state.get('hints') or [None] * len(state['images'])
+        face_chips, face_cached = [], []
+
+        for img, dets, img_hints in zip(state['images'], state['dets'], hints):
+            cached = self.match_hints(dets, img_hints)
+            chips = [self.aligner.align(img, det)
+                     for i, det in enumerate(dets) if i not in cached]
+            face_chips.append(chips)
+            face_cached.append(cached)
+
+        state['chips'] = face_chips
+        state['cached'] = face_cached
+
+        return state
+
+    def encode_faces(self, state):
+        # Encode face chips of all the images of a batch in a single call, and
+        # keep numbers of faces per image to scatter the results back.
+        batch_size = state.get('batch_size', 32)
+        chips = [c for img_chips in state['chips'] for c in img_chips]
+        state['face_counts'] = [len(c) for c in state['chips']]
+        state['vecs'] = self.encoder.encode(chips, batch_size) if chips else []
+
+        return state
 
-            if not len(dets):
-                faces.append([])
-                continue
+    def classify_faces(self, state):
+        threshold = state.get('threshold')
+        vecs = state['vecs']
+        face_ids = []
+
+        if len(vecs):
+            face_ids = self.clf.predict(vecs, threshold, proba=True)
+
+        faces = []
+        start = 0
 
-            face_chips = []
+        for dets, cached, count in zip(state['dets'], state['cached'],
+                                       state['face_counts']):
+            classified = iter(face_ids[start:start + count])
+            start += count
+            img_faces = []
 
-            for det in dets:
-                chip = self.aligner.align(img, det)
-                face_chips.append(chip)
+            for i, det in enumerate(dets):
 
-            face_vecs = self.encoder.encode(face_chips, batch_size)
-            face_ids = self.clf.predict(face_vecs, threshold, proba=True)
+                if i in cached:
+                    face = {
+                        'label': cached[i]['label'],
+                        'proba': cached[i]['proba'],
+                        'cached': True,
+                    }
+                else:
+                    face = next(classified)
 
-            for i, face in enumerate(face_ids):
-                face['box'] = self.detector.rect_to_list(dets[i].rect)
+                face['box'] = self.detector.rect_to_list(det.rect)
+                img_faces.append(face)
 
-            faces.append(face_ids)
+            faces.append(img_faces)
 
-        return faces
+        state['predictions'] = faces
 
+        return state
@@ -0,0 +1,144 @@
+import os
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from cfg import settings
+
+
+class EmbeddingStore:
+
+    DATA_FILE = 'embeddings.f32'
+    INDEX_FILE = 'embeddings.tsv'
+    META_FILE = 'embeddings.json'
+
+    def __init__(self, path, dim=128):
+        self.path = Path(path)
+        self.data_file = self.path.joinpath(self.DATA_FILE)
+        self.index_file = self.path.joinpath(self.INDEX_FILE)
+        self.meta_file = self.path.joinpath(self.META_FILE)
+        self.meta = self.load_meta(dim)
+
+    @property
+    def log(self):
+        return logging.getLogger(settings.logger)
+
+    @property
+    def dim(self):
+        return self.meta['dim']
+
+    def __len__(self):
+        return self.meta['count']
+
+    def exists(self):
+        return self.meta_file.exists()
+
+    def load_meta(self, dim):
+
+        if not self.meta_file.exists():
+            return {'dim': dim, 'count': 0, 'index_size': 0}
+
+        with open(self.meta_file) as f:
+            return json.load(f)
+
+    def save_meta(self):
+        # The meta file is a commit point of the store, so replace it
+        # atomically once the data and the index have been written.
+        tmp_file = self.meta_file.with_suffix('.tmp')
+
+        with open(tmp_file, 'w') as f:
+            json.dump(self.meta, f)
+
+        os.replace(tmp_file, self.meta_file)
+
+    def append(self, vecs, labels, sources):
+        vecs = np.asarray(vecs, dtype=np.float32).reshape(-1, self.dim)
+
+        if not len(vecs):
+            return
+
+        # Discard data which could be left by an interrupted append, i.e.
+        # written but not committed to the meta file.
+        row_size = self.dim * np.dtype(np.float32).itemsize
+
+        with open(self.data_file, 'ab') as f:
+            f.truncate(len(self) * row_size)
+            f.write(vecs.tobytes())
+
+        lines = []
+
+        for label, source in zip(labels, sources):
+            source = os.path.relpath(source, self.path)
+            name = os.path.splitext(os.path.basename(source))[0]
+            lines.append(f'{name}\t{label}\t{source}\n')
+
+        index = ''.join(lines).encode('utf-8')
+
+        with open(self.index_file, 'ab') as f:
+            f.truncate(self.meta['index_size'])
+            f.write(index)
+
+        self.meta['count'] += len(vecs)
+        self.meta['index_size'] += len(index)
+        self.save_meta()
+
+    def load_index(self):
+        ids, labels, sources = [], [], []
+
+        if not len(self):
+            return ids, labels, sources
+
+        with open(self.index_file, 'rb') as f:
+            index = f.read(self.meta['index_size']).decode('utf-8')
+
+        for line in index.splitlines():
+            face_id, label, source = line.split('\t')
+            ids.append(face_id)
+            labels.append(label)
+            sources.append(source)
+
+        return ids, labels, sources
+
+    def load(self):
+        # Face vectors are memory mapped, so they are read on demand in one
+        # shot instead of loading a file per face.
+        vecs = np.memmap(self.data_file, dtype=np.float32, mode='r',
+                         shape=(len(self), self.dim))
+        _, labels, _ = self.load_index()
+
+        return vecs, np.array(labels)
+
+    def sources(self):
+        _, _, sources = self.load_index()
+
+        return {os.path.join(self.path, s) for s in sources}
+
+    def import_npy(self, path):
+        # Import face vectors stored in separate .npy files of the face
+        # database subfolders named after class labels.
+        for face_dir in sorted(Path(path).glob('*')):
+
+            if not face_dir.is_dir():
+                continue
+
+            npy_files = sorted(face_dir.glob('*.npy'))
+
+            if not npy_files:
+                continue
+
+            self.log.info(f'Import {len(npy_files)} face vectors '
+                          f'from {face_dir}')
+            vecs = [np.load(f) for f in npy_files]
+            labels = [face_dir.name] * len(npy_files)
+            self.append(vecs, labels, npy_files)
+
+    def clear(self):
+
+        for f in (self.meta_file, self.data_file, self.index_file):
+
+            if f.exists():
+                f.unlink()
+
+        self.meta = self.load_meta(self.dim)
@@ -1,19 +1,58 @@
+import time
 import logging
 from threading import Thread, Event
 
 from cfg import settings
 from tracker import TargetTracker
+from utils.metrics import registry
+from vision.predictor.abc import STAGE_LATENCY
 from vision.task import VisionTask
 from video.frame import FrameBuffer
+from video.motion import MotionDetector
+
+
+FRAMES = registry.counter(
+    'faceid_frames_total', 'Frames read from a camera.', ['camera'])
+FRAMES_RECOGNIZED = registry.counter(
+    'faceid_frames_recognized_total', 'Frames submitted for recognition.',
+    ['camera'])
+FRAMES_STILL = registry.counter(
+    'faceid_frames_still_total', 'Keyframes skipped for lack of motion.',
+    ['camera'])
+CAMERA_FPS = registry.gauge(
+    'faceid_camera_fps', 'Frames read from a camera per second.', ['camera'])
+RESULT_LATENCY = registry.histogram(
+    'faceid_result_latency_seconds',
+    'Latency from a frame capture to its recognition results.', ['camera'])
 
 
 class FaceWatcher(Thread):
 
-    def __init__(self, task_queue, video_stream, show=False):
+    def __init__(self, task_queue, video_stream, show=False,
+                 keyframe_interval=None, adaptive=False, track_cache=False,
+                 roi=False):
         self.task_queue = task_queue
         self.video_stream = video_stream
         self.frame_buffer = FrameBuffer() if show else None
         self.tracker = TargetTracker(video_stream.size)
+        self.keyframe_interval = (keyframe_interval
+                                  or settings.watcher_keyframe_interval)
+        self.adaptive = adaptive
+        self.track_cache = track_cache
+        self.roi = roi
+        self.keyframes = 0
+        self.fps_frames = 0
+        self.fps_start = time.monotonic()
+        self.motion = {**settings.motion_detection,
+                       **(video_stream.motion or {})}
+        self.motion_detector = None
+
+        if self.motion['enabled']:
+            self.motion_detector = MotionDetector(self.motion['sensitivity'])
+            # Motion is detected on frames decoded at a reduced scale:
+            self.motion_scale = video_stream.reduced_scale(
+                settings.motion_frame_width)
+
         self.join_event = Event()
         super().__init__(name='FaceWatcher')
 
@@ -21,27 +60,139 @@ class FaceWatcher(Thread):
     def log(self):
         return logging.getLogger(settings.logger)
 
+    def get_keyframe_interval(self):
+
+        if not self.adaptive:
+            return self.keyframe_interval
+
+        # Stretch the interval between keyframes while all of the tracked
+        # targets are recognized with a high confidence. Once a new face
+        # appears or the confidence drops, fall back to the base interval.
+        confidence = self.tracker.confidence()
+
+        if confidence < settings.watcher_keyframe_confidence:
+            return self.keyframe_interval
+
+        return max(self.keyframe_interval,
+                   settings.watcher_keyframe_max_interval)
+
+    def is_moving(self, frames_skipped):
+        # Frames of a still scene are not recognized, unless nothing has been
+        # recognized for too long.
+        if self.motion_detector is None:
+            return True
+
+        if frames_skipped + 1 >= self.motion['max_skip']:
+            return True
+
+        frame = self.video_stream.decode(self.motion_scale)
+
+        return frame is None or self.motion_detector.detect(frame)
+
+    def count_frame(self):
+        camera = self.video_stream.path
+        FRAMES.inc(camera=camera)
+        self.fps_frames += 1
+        elapsed = time.monotonic() - self.fps_start
+
+        if elapsed >= settings.metrics_fps_interval:
+            CAMERA_FPS.set(self.fps_frames / elapsed, camera=camera)
+            self.fps_frames = 0
+            self.fps_start = time.monotonic()
+
+    def get_task_params(self):
+        params = {'detection': self.video_stream.detection}
+
+        if self.track_cache:
+            params['hints'] = self.tracker.get_cached()
+
+        # Faces are searched around predicted locations of the tracked targets
+        # only, except for periodic full-frame sweeps catching newcomers.
+        if self.roi:
+            sweep = self.keyframes % settings.roi_sweep_interval == 0
+
+            if not sweep and self.tracker.targets:
+                params['rois'] = self.tracker.predict_rois(settings.roi_margin)
+
+        self.keyframes += 1
+
+        return params
+
     def run(self):
         self.log.info('Start watching faces...')
-        task = VisionTask()
+        task = None
+        frames_skipped = 0
 
         while not self.join_event.is_set():
-            frame = self.video_stream.read()
-
-            if frame is None:
+            # Frames are decoded at full resolution only once they are
+            # recognized or shown.
+            if not self.video_stream.grab():
                 self.log.warning(f'Failed to read from {self.video_stream.path}')
                 continue
 
-            task.image = frame
-            self.task_queue.put(task)
-            self.tracker.update(task.results)
+            self.count_frame()
+            camera = self.video_stream.path
+
+            # Never wait for the results of face recognition. Instead, keep
+            # reading frames and let the tracker consume the results of the
+            # in-flight task as soon as they arrive.
+            if task is not None and task.done():
+
+                try:
+                    results = task.results
+                    RESULT_LATENCY.observe(time.time() - task_timestamp,
+                                           camera=camera)
+                    start = time.monotonic()
+                    self.tracker.update(results)
+                    STAGE_LATENCY.observe(time.monotonic() - start,
+                                          stage='track')
+                except Exception as e:
+                    self.log.warning(f'Vision task failed: {e}')
+
+                task_ring.unpin(task_seq)
+                task = None
+
+            # Run full face recognition on keyframes only, and keep at most
+            # one task in flight. The frames in between are served by the
+            # tracker alone.
+            keyframe = frames_skipped + 1 >= self.get_keyframe_interval()
+            submit = keyframe and task is None
+
+            if submit and not self.is_moving(frames_skipped):
+                FRAMES_STILL.inc(camera=camera)
+                self.tracker.idle()
+                submit = False
+
+            frame = self.video_stream.decode() if submit else None
+
+            if frame is not None:
+                # The frame is converted in place and read by the handler
+                # right from the frame ring, so pin it until the task is done.
+                task_ring = self.video_stream.ring
+                task_seq = frame.seq
+                task_timestamp = frame.timestamp
+                task_ring.pin(task_seq)
+                image = frame.convert('rgb', inplace=True)
+                task = VisionTask(image, **self.get_task_params())
+                self.task_queue.put(task)
+                FRAMES_RECOGNIZED.inc(camera=camera)
+                frames_skipped = 0
+            else:
+                frames_skipped += 1
+
             targets = self.tracker.get_targets()
 
             if self.frame_buffer is not None:
-                self.frame_buffer.add(frame, targets, self.video_stream.path)
+                frame = self.video_stream.decode()
+
+                # The frame is shown after its ring slot may be reused, so the
+                # display gets a copy of it.
+                if frame is not None:
+                    self.frame_buffer.add(frame.copy(), targets,
+                                          self.video_stream.path)
 
     def join(self, timeout=None):
         self.log.info(f'Stopping {self.name} thread...')
         self.join_event.set()
         super().join(timeout)
-
+        self.video_stream.close()
@@ -3,21 +3,28 @@ import os
 import sys
 import json
 import time
+import shutil
+import signal
 from queue import Queue
 
 import click
-import numpy as np
-from PIL import Image
 
 from cfg import settings
 from face.watcher import FaceWatcher
 from face.classifier import FaceClassifier
-from face.recognizer import FaceRecognizer
+from face.ingest import FaceIngestor
+from face.store import EmbeddingStore
 from tracker import TargetKeeper
 from video.frame import FrameBuffer
 from video.utils import create_stream, apply_device_settings
 from vision.handler import VisionTaskHandler
+from vision.pipeline import StagedTaskHandler
+from vision.process import ProcessTaskHandler
+from vision.reloader import ModelReloader
+from utils.benchmark import StageBenchmark
 from utils.logger import init_logger
+from utils.metrics import MetricsServer
+from utils.profiler import ProfilerSwitch
 
 
 log = init_logger(settings.logger)
@@ -33,31 +40,85 @@ def faceid():
 @click.option('-t', '--task-handlers', type=int, default=1, show_default=True,
               help='A number of vision task handler threads.')
 @click.option('-b', '--batch-size', type=int, default=32, show_default=True,
-              help='A size of a vision task batch.')
+              help='A max size of a vision task batch.')
+@click.option('-l', '--latency-target', type=float,
+              default=settings.batch_latency_target, show_default=True,
+              help='A target latency of a vision task batch (sec).')
+@click.option('-k', '--keyframe-interval', type=int,
+              default=settings.watcher_keyframe_interval, show_default=True,
+              help='Recognize faces on every N-th frame, track in between.')
+@click.option('--adaptive', is_flag=True,
+              help='Adapt the keyframe interval to the tracking confidence.')
+@click.option('--track-cache', is_flag=True,
+              help='Reuse labels of confidently recognized targets.')
+@click.option('--roi', is_flag=True,
+              help='Detect faces around predicted target locations only.')
+@click.option('--predictor', type=click.Choice(['face', 'person_face']),
+              default='face', show_default=True,
+              help='A predictor (person_face detects faces of persons only).')
+@click.option('--staged', is_flag=True,
+              help='Run predictor stages in separate worker pools.')
+@click.option('-p', '--processes', is_flag=True,
+              help='Run vision task handlers in separate processes.')
+@click.option('--reload/--no-reload', default=True, show_default=True,
+              help='Reload the face classifier once its file changes.')
+@click.option('--metrics-port', type=int,
+              help='Serve pipeline metrics (Prometheus) on the port.')
+@click.option('--profile', type=float,
+              help='Profile pipeline threads for the first N seconds.')
 @click.option('-s', '--show', is_flag=True, help='Show tracked faces.')
-def run(task_handlers, batch_size, show):
+def run(task_handlers, batch_size, latency_target, keyframe_interval,
+        adaptive, track_cache, roi, predictor, staged, processes, reload,
+        metrics_port, profile, show):
     '''Start watching faces.
+
+    Send SIGUSR1 to start or stop profiling pipeline threads at any time.
     '''
+    profiler = ProfilerSwitch()
+    signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.toggle())
+
     try:
         task_queue = Queue()
         handlers, watchers = [], []
         log.info(f'Start {task_handlers} vision task handler(s)...')
 
+        if processes:
+            handler_cls = ProcessTaskHandler
+        elif staged:
+            handler_cls = StagedTaskHandler
+        else:
+            handler_cls = VisionTaskHandler
+
         for _ in range(task_handlers):
-            h = VisionTaskHandler('face', task_queue, batch_size)
+            h = handler_cls(predictor, task_queue, batch_size,
+                            latency_target)
             h.start()
             handlers.append(h)
 
+        if reload:
+            reloader = ModelReloader(handlers[:])
+            reloader.start()
+            handlers.append(reloader)
+
+        if metrics_port is not None:
+            metrics_server = MetricsServer(metrics_port)
+            metrics_server.start()
+            handlers.append(metrics_server)
+
         watcher_num = len(settings.video_conf_files)
         log.info(f'Start {watcher_num} face watcher(s)...')
 
         for conf_file in settings.video_conf_files:
             video_stream = create_stream(conf_file)
             log.info(f'Start video stream from {video_stream.path}')
-            w = FaceWatcher(task_queue, video_stream, show)
+            w = FaceWatcher(task_queue, video_stream, show,
+                            keyframe_interval, adaptive, track_cache, roi)
             w.start()
             watchers.append(w)
 
+        if profile:
+            profiler.start(profile)
+
         target_keeper = TargetKeeper()
         frame_buffer = FrameBuffer() if show else None
 
@@ -77,6 +138,7 @@ def run(task_handlers, batch_size, show):
     except KeyboardInterrupt:
         pass
     finally:
+        profiler.stop()
         # First, join watchers, then handlers. The order does matter.
         threads = watchers + handlers
 
@@ -84,6 +146,59 @@ def run(task_handlers, batch_size, show):
             t.join()
 
 
+@faceid.command()
+@click.option('-s', '--stages', multiple=True,
+              type=click.Choice(StageBenchmark.STAGES),
+              help='Stages to benchmark (all by default).')
+@click.option('-r', '--resolution', 'resolutions', multiple=True,
+              default=['640x480', '1280x720'], show_default=True,
+              help='Image resolutions (WxH).')
+@click.option('-b', '--batch-size', 'batch_sizes', type=int, multiple=True,
+              default=[1, 8, 32], show_default=True, help='Batch sizes.')
+@click.option('-f', '--faces', 'face_counts', type=int, multiple=True,
+              default=[1, 4], show_default=True, help='Numbers of faces.')
+@click.option('-n', '--repeat', type=int, default=10, show_default=True,
+              help='A number of measured runs per benchmark.')
+@click.option('-i', '--images', help='A path to sample images.')
+@click.option('-o', '--output', help='A path to output results (json).')
+@click.option('--baseline', help='A path to baseline results to compare.')
+@click.option('--tolerance', type=float, default=0.1, show_default=True,
+              help='A relative slowdown which counts as a regression.')
+def bench(stages, resolutions, batch_sizes, face_counts, repeat, images,
+          output, baseline, tolerance):
+    '''Benchmark pipeline stages on synthetic or sample images.
+    '''
+    resolutions = [tuple(map(int, r.split('x'))) for r in resolutions]
+    benchmark = StageBenchmark(repeat, img_dir=images)
+    benchmark.run(stages, resolutions, batch_sizes, face_counts)
+    report = benchmark.report()
+    regressions = []
+
+    if baseline is not None:
+
+        with open(baseline) as f:
+            report['comparison'] = benchmark.compare(json.load(f), tolerance)
+
+        regressions = [c for c in report['comparison'] if c['regression']]
+
+    report_json = json.dumps(report, indent=2)
+
+    if output is not None:
+        log.info(f'Save benchmark results to {output}')
+
+        with open(output, 'w') as f:
+            f.write(report_json)
+    else:
+        click.echo(report_json)
+
+    for r in regressions:
+        log.warning(f'Regression in {r["stage"]} {r["params"]}: throughput '
+                    f'x{r["throughput"]:.2f}, p95 latency x{r["p95"]:.2f}')
+
+    if regressions:
+        sys.exit(1)
+
+
 @faceid.group()
 def video():
     '''Manage video devices.
@@ -135,6 +250,8 @@ def live(conf_json, output):
 
     except KeyboardInterrupt:
         pass
+    finally:
+        video_stream.close()
 
 
 @faceid.group()
@@ -149,13 +266,16 @@ def model():
 @click.option('-t', '--test-size', type=float, default=0.2, show_default=True,
               help='A size of a test part of the training data.')
 @click.option('-o', '--output', help='A path to the output model.')
+@click.option('-c', '--classifier', type=click.Choice(['knn', 'gallery']),
+              default=settings.clf_model, show_default=True,
+              help='A face classifier model.')
 @click.option('--optimize', is_flag=True, help='Optimize model parameters.')
-def train(facedb, test_size, output, optimize):
+def train(facedb, test_size, output, classifier, optimize):
     '''Train a face recognizer model.
     '''
     log.info(f'Train a face recognizer on the face database {facedb}')
 
-    clf = FaceClassifier()
+    clf = FaceClassifier(model_name=classifier)
     clf.train(facedb, test_size, optimize)
 
     if output is None:
@@ -204,76 +324,73 @@ def db():
 @db.command()
 @click.option('-f', '--facedb', required=True,
               help='A path to the face database.')
+@click.option('-w', '--workers', type=int, default=4, show_default=True,
+              help='A number of image decoding workers.')
+@click.option('-b', '--batch-size', type=int, default=32, show_default=True,
+              help='A number of images processed at once.')
 @click.option('--force', is_flag=True, help='Force encoding all found images.')
-def init(facedb, force):
+def init(facedb, workers, batch_size, force):
     '''Initialize a face database.
-    '''
-    recognizer = FaceRecognizer()
-
-    input_files = [os.path.join(facedb, f) for f in os.listdir(facedb)]
-    dirnames = [f for f in input_files if os.path.isdir(f)]
-    n = len(dirnames)
 
-    log.info(f'Inspecting the face database {facedb}')
-    images = []
+    An interrupted run resumes from where it stopped.
+    '''
+    ingestor = FaceIngestor(facedb, workers, batch_size)
+    ingestor.run(force)
 
-    for i, dirname in enumerate(dirnames, start=1):
-        log.info(f'[{i}/{n}] {dirname}')
 
-        files = [os.path.join(dirname, f) for f in os.listdir(dirname)]
-        img_files = [
-            f for f in files if f.endswith('.jpg') and 'aligned' not in f]
+@db.command()
+@click.option('-f', '--facedb', required=True,
+              help='A path to the face database.')
+@click.option('-n', '--name', required=True, help='A name of the person.')
+@click.option('-m', '--model', required=True,
+              help='A path to the face recognizer model.')
+@click.option('-o', '--output', help='A path to the output model.')
+@click.argument('images', nargs=-1, required=True)
+def add(facedb, name, model, output, images):
+    '''Add face images of a person to the face database and the model.
+    '''
+    person_dir = os.path.join(facedb, name)
+    os.makedirs(person_dir, exist_ok=True)
+    img_files = []
 
-        if not img_files:
-            log.warning('No images found.')
-            continue
+    for img_file in images:
+        dst_file = os.path.join(person_dir, os.path.basename(img_file))
 
-        if force:
-            images.extend(img_files)
-            continue
+        if not os.path.exists(dst_file):
+            shutil.copy(img_file, dst_file)
 
-        # Find face images which don't have embeddings (.npy files):
-        npy_files = {
-            os.path.splitext(f)[0] for f in files if f.endswith('.npy')
-        }
+        img_files.append(dst_file)
 
-        for f in img_files:
-            name = os.path.splitext(f)[0]
+    # The store is bootstrapped first, so that it keeps all of the known
+    # faces, and only the new ones are enrolled.
+    ingestor = FaceIngestor(facedb)
+    ingestor.bootstrap()
+    start = len(ingestor.store)
+    ingestor.run(img_files=img_files)
 
-            if name not in npy_files:
-                images.append(f)
+    face_vecs, labels = ingestor.store.load()
+    face_vecs, labels = face_vecs[start:], labels[start:]
 
-    if not images:
+    if not len(face_vecs):
+        log.warning('No new faces found. Nothing to add.')
         return
 
-    n = len(images)
-    log.info(f'Found {n} images for processing.')
-
-    for i, img_file in enumerate(images, start=1):
-        log.info(f'[{i}/{n}] Process image {img_file}')
-        img = np.array(Image.open(img_file))
-        dets = recognizer.detector.detect([img])[0]
-
-        if not len(dets):
-            log.warning('No faces found. Ignore image.')
-            continue
-
-        face = dets[0]
-        face_img = recognizer.aligner.align(img, face)
-
-        img_dir = os.path.dirname(img_file)
-        basename = os.path.basename(img_file)
-        name, ext = os.path.splitext(basename)
-        face_img_file = os.path.join(img_dir, f'{name}_aligned{ext}')
-
-        log.info(f'Save aligned face to {face_img_file}')
-        Image.fromarray(face_img).save(face_img_file)
+    clf = FaceClassifier(model)
+    clf.enroll(face_vecs, labels, facedb)
+    clf.save(output or model)
 
-        face_emb = recognizer.encoder.encode([face_img])[0]
 
-        face_emb_file = os.path.join(img_dir, f'{name}.npy')
-        log.info(f'Save face embedding to {face_emb_file}')
-        np.save(face_emb_file, face_emb)
+@db.command()
+@click.option('-f', '--facedb', required=True,
+              help='A path to the face database.')
+def pack(facedb):
+    '''Pack face embeddings (.npy files) into a single store.
+    '''
+    log.info(f'Pack face embeddings of the face database {facedb}')
+    store = EmbeddingStore(facedb)
+    store.clear()
+    store.import_npy(facedb)
+    log.info(f'Done. The store has {len(store)} face embeddings.')
 
 
 if __name__ == '__main__':
@@ -1,4 +1,3 @@
-import os
 import json
 import logging
 
@@ -22,23 +21,20 @@ class PersonDetector(Predictor):
         return logging.getLogger(settings.logger)
 
     def load_models(self):
-        pwd = os.getcwd()
-        os.chdir(settings.model_conf_file.parent)
-
         with open(settings.model_conf_file) as f:
             cfg = json.load(f)
 
-        model_path = cfg['person_detector']
+        # Model paths are relative to the model configuration file:
+        root = settings.model_conf_file.parent
+        model_path = root.joinpath(cfg['person_detector'])
         self.log.info(f'Load a person detector from {model_path}')
 
-        model_name = os.path.basename(model_path)
+        model_name = model_path.name
         self.detector = cv2.dnn.readNetFromTensorflow(
-            os.path.join(model_path, f'{model_name}.pb'),
-            os.path.join(model_path, f'{model_name}.pbtxt')
+            str(model_path.joinpath(f'{model_name}.pb')),
+            str(model_path.joinpath(f'{model_name}.pbtxt'))
         )
 
-        os.chdir(pwd)
-
     def detect(self, images):
         image_blob = cv2.dnn.blobFromImages(images,
                                             size=self.DETECT_IMAGE_SIZE,
@@ -51,14 +47,13 @@ class PersonDetector(Predictor):
         except ValueError:
             return [[] for _ in range(len(images))]
 
-        w, h = self.DETECT_IMAGE_SIZE
-        img_h, img_w = images[0].shape[:2]
-        w_scale, h_scale = img_w / w, img_h / h
-
         person_index = 1
         image_persons = []
 
-        for dets in image_dets:
+        for img, dets in zip(images, image_dets):
+            # Detections are relative, so they are scaled by the size of each
+            # image, which may differ within a batch:
+            img_h, img_w = img.shape[:2]
             persons = []
 
             for det in dets:
@@ -70,10 +65,10 @@ class PersonDetector(Predictor):
                 if class_proba < self.DETECT_PROBA_THRES:
                     continue
 
-                xmin = int(det[3] * w * w_scale)
-                ymin = int(det[4] * h * h_scale)
-                xmax = int(det[5] * w * w_scale)
-                ymax = int(det[6] * h * h_scale)
+                xmin = int(det[3] * img_w)
+                ymin = int(det[4] * img_h)
+                xmax = int(det[5] * img_w)
+                ymax = int(det[6] * img_h)
 
                 persons.append({
                     'label': 'person',
@@ -85,14 +80,11 @@ class PersonDetector(Predictor):
 
         return image_persons
 
-    def predict(self, images, batch_size=32):
-        batches = round(len(images) / batch_size) or 1
+    def predict(self, images, batch_size=32, **params):
         predictions = []
 
-        for i in range(batches):
-            batch_start = i * batch_size
-            batch_end = (i + 1) * batch_size
-            batch = images[batch_start:batch_end]
+        for batch_start in range(0, len(images), batch_size):
+            batch = images[batch_start:batch_start + batch_size]
             batch_preds = self.detect(batch)
             predictions.append(batch_preds)
 
@@ -0,0 +1,32 @@
+from queue import Queue
+
+from vision.batcher import AdaptiveBatcher
+
+
+def make_batcher(tasks, max_size=32):
+    task_queue = Queue()
+
+    for i in range(tasks):
+        task_queue.put(i)
+
+    batcher = AdaptiveBatcher(task_queue, max_size, latency_target=0.1,
+                              max_wait=0)
+    # A task takes 50 ms, so two tasks fit the latency target:
+    batcher.observe(4, 0.2)
+
+    return batcher
+
+
+def test_batch_size_follows_latency():
+    batcher = make_batcher(3)
+
+    assert batcher.batch_size == 2
+    assert batcher.next_batch(timeout=0) == [0, 1]
+    assert batcher.next_batch(timeout=0) == [2]
+
+
+def test_batch_grows_with_backlog():
+    batcher = make_batcher(100)
+    sizes = [len(batcher.next_batch(timeout=0)) for _ in range(7)]
+
+    assert sizes == [2, 4, 8, 16, 32, 32, 2]
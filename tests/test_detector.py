@@ -0,0 +1,50 @@
+import logging
+from collections import Counter
+
+import pytest
+
+dlib = pytest.importorskip('dlib')
+pytest.importorskip('cv2')
+
+from cfg import settings
+from face.detector import FaceDetection, FaceDetector
+
+
+def make_detector(stats_interval=10):
+    detector = FaceDetector.__new__(FaceDetector)
+    detector.cascade = {**settings.face_cascade,
+                        'stats_interval': stats_interval}
+    detector.cascade_stats = Counter()
+    detector.cascade_logged = 0
+
+    return detector
+
+
+def make_dets(boxes):
+    return [FaceDetection(dlib.rectangle(*box), 1.0) for box in boxes]
+
+
+def test_compare_matches_one_to_one():
+    detector = make_detector()
+    hog_dets = make_dets([(0, 0, 100, 100)])
+    cnn_dets = make_dets([(0, 0, 100, 100), (5, 5, 105, 105)])
+    detector.compare(hog_dets, cnn_dets)
+
+    assert detector.cascade_stats['hog_hits'] == 1
+    assert detector.cascade_stats['hog_misses'] == 1
+    assert detector.cascade_stats['hog_false_alarms'] == 0
+
+
+def test_stats_logged_across_interval(caplog):
+    # Batches of 3 frames never hit a multiple of 10 frames exactly.
+    detector = make_detector(stats_interval=10)
+
+    with caplog.at_level(logging.INFO, logger=settings.logger):
+
+        for _ in range(8):
+            detector.cascade_stats['frames'] += 3
+            detector.log_cascade_stats()
+
+    logged = [r for r in caplog.records if 'cascade' in r.getMessage()]
+
+    assert len(logged) == 2
@@ -0,0 +1,98 @@
+from queue import Queue
+
+import numpy as np
+import pytest
+
+pytest.importorskip('dlib')
+pytest.importorskip('cv2')
+
+from face.detector import FaceDetection
+from face.recognizer import FaceRecognizer
+from vision.handler import VisionTaskHandler
+from vision.task import VisionTask
+
+
+class Rect:
+
+    def __init__(self, box):
+        self.box = box
+
+    def left(self):
+        return self.box[0]
+
+    def top(self):
+        return self.box[1]
+
+    def right(self):
+        return self.box[2]
+
+    def bottom(self):
+        return self.box[3]
+
+
+class Detector:
+
+    def detect(self, images, batch_size, upsample, downscale):
+        return [[FaceDetection(Rect([10, 10, 60, 60]), 1.0)] for _ in images]
+
+    def detect_rois(self, images, rois, batch_size, upsample):
+        return self.detect(images, batch_size, upsample, 1)
+
+    def filter_size(self, dets, min_size):
+        return dets
+
+    def rect_to_list(self, rect):
+        return list(rect.box)
+
+
+class Aligner:
+
+    def align(self, img, det):
+        return np.zeros((150, 150, 3), np.uint8)
+
+
+class Encoder:
+
+    def encode(self, chips, batch_size):
+        return np.zeros((len(chips), 128))
+
+
+class Classifier:
+
+    def predict(self, vecs, threshold=None, proba=False):
+        return [{'label': 'John', 'proba': 0.9} for _ in vecs]
+
+
+class Handler(VisionTaskHandler):
+
+    def build_predictor(self, name):
+        recognizer = FaceRecognizer.__new__(FaceRecognizer)
+        recognizer.detector = Detector()
+        recognizer.aligner = Aligner()
+        recognizer.encoder = Encoder()
+        recognizer.clf = Classifier()
+
+        return recognizer
+
+
+def test_handle_watcher_task():
+    # Tasks of a face watcher come with detection settings, tracker hints
+    # and regions of interest, which are all passed to the recognizer.
+    task_queue = Queue()
+    handler = Handler('face', task_queue)
+    image = np.zeros((120, 160, 3), np.uint8)
+    tasks = [
+        VisionTask(image, detection={'downscale': 1, 'upsample': 1,
+                                     'min_face_size': 40}),
+        VisionTask(image, detection=None, hints=[], rois=[[0, 0, 80, 80]]),
+    ]
+
+    for task in tasks:
+        task_queue.put(task)
+
+    handler.handle(tasks)
+
+    for task in tasks:
+        assert task.get_results(timeout=1) == [
+            {'label': 'John', 'proba': 0.9, 'box': [10, 10, 60, 60]}
+        ]
@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('dlib')
+pytest.importorskip('cv2')
+
+import face.ingest
+from face.ingest import FaceIngestor
+
+
+@pytest.fixture
+def facedb(tmp_path, monkeypatch):
+    # A database of one image encoded before the embedding store existed.
+    monkeypatch.setattr(face.ingest, 'FaceRecognizer', lambda: None)
+    person_dir = tmp_path / 'John'
+    person_dir.mkdir()
+    (person_dir / 'a.jpg').touch()
+    np.save(person_dir / 'a.npy', np.ones(128))
+
+    return str(tmp_path)
+
+
+def test_find_images_imports_npy(facedb):
+    assert FaceIngestor(facedb).find_images() == []
+
+
+def test_find_images_forced(facedb):
+    ingestor = FaceIngestor(facedb)
+    ingestor.reset()
+
+    assert ingestor.find_images(force=True) == [
+        os.path.join(facedb, 'John', 'a.jpg')
+    ]
+
+
+def test_run_skips_encoded_images(facedb, monkeypatch):
+    ingestor = FaceIngestor(facedb)
+    ingestor.bootstrap()
+    monkeypatch.setattr(ingestor, 'process', pytest.fail)
+    ingestor.run(img_files=[os.path.join(facedb, 'John', 'a.jpg')])
+
+    assert len(ingestor.store) == 1
+
+
+def test_find_images_retries_errors(facedb):
+    ingestor = FaceIngestor(facedb)
+    img_file = os.path.join(facedb, 'John', 'b.jpg')
+    open(img_file, 'w').close()
+    ingestor.record(img_file, 'error')
+
+    assert ingestor.find_images() == [img_file]
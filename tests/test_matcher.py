@@ -0,0 +1,20 @@
+import numpy as np
+from sklearn.neighbors import KNeighborsClassifier
+
+from face.model.matcher import GalleryMatcher
+
+
+def test_distance_weights_match_sklearn_on_duplicates():
+    # Queries duplicating gallery vectors are exact matches, which outweigh
+    # any other neighbors as in scikit-learn.
+    rng = np.random.RandomState(0)
+    X = rng.normal(0, 0.1, size=(200, 128))
+    y = np.arange(200) % 5
+    X_query = X[:50]
+
+    matcher = GalleryMatcher(n_neighbors=5, weights='distance').fit(X, y)
+    knn = KNeighborsClassifier(n_neighbors=5, weights='distance',
+                               algorithm='kd_tree').fit(X, y)
+
+    np.testing.assert_allclose(matcher.predict_proba(X_query),
+                               knn.predict_proba(X_query), atol=1e-6)
@@ -0,0 +1,14 @@
+from video.ring import FrameRing
+
+
+def test_acquire_full_ring():
+    # A frame is dropped rather than written over a pinned one.
+    ring = FrameRing((2, 2, 3), slots=1)
+    seq = ring.commit(ring.acquire())
+    ring.pin(seq)
+
+    assert ring.acquire() is None
+
+    ring.unpin(seq)
+
+    assert ring.acquire() == 0
@@ -0,0 +1,15 @@
+from tracker import TargetTracker
+
+
+def test_update_without_matched_pairs():
+    # A face leaves and another one appears too far away to be matched, so
+    # the old target is lost and the new one is tracked.
+    tracker = TargetTracker((800, 600))
+    tracker.update([{'label': 'John', 'proba': 0.9, 'box': [0, 0, 50, 50]}])
+    tracker.update([
+        {'label': 'Jane', 'proba': 0.9, 'box': [700, 500, 780, 590]},
+    ])
+
+    labels = [t.label for t in tracker.get_targets()]
+    assert labels == ['John', 'Jane']
+    assert tracker.lost_frames.tolist() == [1, 0]
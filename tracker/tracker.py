@@ -1,167 +1,284 @@
-from functools import partial
-from collections import defaultdict, deque, Counter
-
 import numpy as np
+from scipy.optimize import linear_sum_assignment
 from scipy.spatial import distance
 
+from cfg import settings
 from .target import Target
 from .keeper import TargetKeeper
-from .utils import box_center
+from .utils import box_centers, box_iou_matrix
 
 
 class TargetTracker:
 
     TARGET_LOST_FRAMES = 10
     TARGET_LABEL_CANDIDATES = 20
+    # A max distance between centroids of a tracked target and a detected
+    # object which can be matched, relative to the image diagonal:
+    TARGET_MAX_DISTANCE = 0.25
 
     def __init__(self, img_size):
         self.img_size = img_size
         self.target_keeper = TargetKeeper()
-        self.targets = {}
-        self.lost_frames = {}
-        label_list = partial(deque, maxlen=self.TARGET_LABEL_CANDIDATES)
-        self.target_labels = defaultdict(label_list)
-
-    def bound_size(self, box):
-        xmin, ymin, xmax, ymax = box
+        # Tracked targets are stored as a struct of arrays, where the i-th
+        # row of each array belongs to the i-th target. Target objects are
+        # views of the tracked targets kept for the target keeper.
+        self.targets = []
+        self.boxes = np.zeros((0, 4), dtype=np.int64)
+        self.velocities = np.zeros((0, 4))
+        self.probas = np.zeros(0)
+        self.lost_frames = np.zeros(0, dtype=np.int64)
+        self.cached_frames = np.zeros(0, dtype=np.int64)
+        self.label_ids = np.zeros(0, dtype=np.int64)
+        # Label candidates of a target are kept in a ring of its last label
+        # ids, and their votes are counted per label id.
+        self.label_names = []
+        self.label_index = {}
+        self.label_history = np.zeros((0, self.TARGET_LABEL_CANDIDATES),
+                                      dtype=np.int64)
+        self.label_pos = np.zeros(0, dtype=np.int64)
+        self.label_votes = np.zeros((0, 0), dtype=np.int64)
+
+    def bound_size(self, boxes):
         w, h = self.img_size
-
-        return max(0, xmin), max(0, ymin), min(w, xmax), min(h, ymax)
-
-    def update_target(self, target_id, prediction):
-
-        try:
-            target = self.targets[target_id]
-            target.proba = prediction['proba']
-            target.box = self.bound_size(prediction['box'])
-
-            new_label = prediction['label']
-            target_labels = self.target_labels[target_id]
-            target_labels.append(new_label)
-
-            if target.label != new_label:
-                counter = Counter(target_labels)
-                most_common_label = counter.most_common()[0][0]
-
-                if most_common_label == new_label:
-                    self.target_keeper.remove(target)
-                    target.label = new_label
-                    self.target_keeper.add(target)
-
-            self.lost_frames[target_id] = 0
-        except KeyError:
-            pass
-
-    def add_target(self, prediction):
-        target = Target(prediction['label'],
-                        prediction['proba'],
-                        prediction['box'])
-        self.target_keeper.add(target)
-        self.targets[target.id] = target
-        self.lost_frames[target.id] = 0
-        self.target_labels[target.id].append(prediction['label'])
-
-    def remove_target(self, target_id):
-
-        try:
-            target = self.targets[target_id]
+        boxes = np.array(boxes, dtype=np.int64).reshape(-1, 4)
+        boxes[:, :2] = np.maximum(boxes[:, :2], 0)
+        boxes[:, 2] = np.minimum(boxes[:, 2], w)
+        boxes[:, 3] = np.minimum(boxes[:, 3], h)
+
+        return boxes
+
+    def get_label_ids(self, labels):
+        label_ids = []
+
+        for label in labels:
+
+            if label not in self.label_index:
+                self.label_index[label] = len(self.label_names)
+                self.label_names.append(label)
+
+            label_ids.append(self.label_index[label])
+
+        # Extend vote counters to fit new labels:
+        new_labels = len(self.label_names) - self.label_votes.shape[1]
+
+        if new_labels > 0:
+            votes = np.zeros((len(self.targets), new_labels), dtype=np.int64)
+            self.label_votes = np.hstack([self.label_votes, votes])
+
+        return np.array(label_ids, dtype=np.int64)
+
+    def vote(self, rows, label_ids):
+        # Push new label candidates to the rings of the given targets (each
+        # target is given at most once), and update their vote counters.
+        pos = self.label_pos[rows]
+        old = self.label_history[rows, pos]
+        valid = old >= 0
+        np.subtract.at(self.label_votes, (rows[valid], old[valid]), 1)
+        self.label_history[rows, pos] = label_ids
+        self.label_votes[rows, label_ids] += 1
+        self.label_pos[rows] = (pos + 1) % self.TARGET_LABEL_CANDIDATES
+
+    def update_targets(self, rows, predictions):
+
+        if not len(rows):
+            return
+
+        boxes = self.bound_size([p['box'] for p in predictions])
+        probas = np.array([p['proba'] for p in predictions], dtype=float)
+        cached = np.array([bool(p.get('cached')) for p in predictions],
+                          dtype=bool)
+        label_ids = self.get_label_ids([p['label'] for p in predictions])
+
+        # Box velocities are smoothed over updates:
+        self.velocities[rows] = (0.5 * self.velocities[rows]
+                                 + 0.5 * (boxes - self.boxes[rows]))
+        self.boxes[rows] = boxes
+        self.probas[rows] = probas
+        self.lost_frames[rows] = 0
+
+        for row, box, proba in zip(rows, boxes, probas):
+            target = self.targets[row]
+            target.proba = float(proba)
+            target.box = tuple(box.tolist())
+
+        # A cached prediction repeats the label of the target, so it is not
+        # counted as a new label candidate.
+        self.cached_frames[rows[cached]] += 1
+        self.cached_frames[rows[~cached]] = 0
+        rows, label_ids = rows[~cached], label_ids[~cached]
+        self.vote(rows, label_ids)
+
+        # Switch the label of a target once the new label becomes the most
+        # common one among its candidates, outvoting the current label.
+        votes = self.label_votes[rows]
+        index = np.arange(len(rows))
+        new_votes = votes[index, label_ids]
+        cur_votes = votes[index, self.label_ids[rows]]
+        switch = ((self.label_ids[rows] != label_ids)
+                  & (new_votes >= votes.max(axis=1, initial=0))
+                  & (new_votes > cur_votes))
+
+        for row, label_id in zip(rows[switch], label_ids[switch]):
+            target = self.targets[row]
             self.target_keeper.remove(target)
-            del self.targets[target_id]
-            del self.lost_frames[target_id]
-            del self.target_labels[target_id]
-        except KeyError:
-            pass
+            target.label = self.label_names[label_id]
+            self.target_keeper.add(target)
+
+        self.label_ids[rows[switch]] = label_ids[switch]
+
+    def add_targets(self, predictions):
+        n = len(predictions)
+        boxes = self.bound_size([p['box'] for p in predictions])
+        probas = np.array([p['proba'] for p in predictions], dtype=float)
+        label_ids = self.get_label_ids([p['label'] for p in predictions])
+
+        for p, box in zip(predictions, boxes):
+            target = Target(p['label'], p['proba'], tuple(box.tolist()))
+            self.target_keeper.add(target)
+            self.targets.append(target)
+
+        history = np.full((n, self.TARGET_LABEL_CANDIDATES), -1,
+                          dtype=np.int64)
+        votes = np.zeros((n, len(self.label_names)), dtype=np.int64)
+        rows = np.arange(len(self.boxes), len(self.boxes) + n)
+
+        self.boxes = np.vstack([self.boxes, boxes])
+        self.velocities = np.vstack([self.velocities, np.zeros((n, 4))])
+        self.probas = np.concatenate([self.probas, probas])
+        self.lost_frames = np.concatenate([self.lost_frames, np.zeros(n, int)])
+        self.cached_frames = np.concatenate([self.cached_frames,
+                                             np.zeros(n, int)])
+        self.label_ids = np.concatenate([self.label_ids, label_ids])
+        self.label_history = np.vstack([self.label_history, history])
+        self.label_pos = np.concatenate([self.label_pos, np.zeros(n, int)])
+        self.label_votes = np.vstack([self.label_votes, votes])
+        self.vote(rows, label_ids)
+
+    def remove_targets(self, rows):
+
+        if not len(rows):
+            return
+
+        for row in rows:
+            self.target_keeper.remove(self.targets[row])
+
+        keep = np.ones(len(self.targets), dtype=bool)
+        keep[rows] = False
+        self.targets = [t for t, k in zip(self.targets, keep) if k]
+
+        for name in ('boxes', 'velocities', 'probas', 'lost_frames',
+                     'cached_frames', 'label_ids', 'label_history',
+                     'label_pos', 'label_votes'):
+            setattr(self, name, getattr(self, name)[keep])
+
+    def lose_targets(self, rows):
+        # Increment lost frame counters of targets which have not been found,
+        # and remove the ones which have been lost for too long.
+        self.lost_frames[rows] += 1
+        lost = rows[self.lost_frames[rows] > self.TARGET_LOST_FRAMES]
+        self.remove_targets(lost)
+
+    def idle(self):
+        # Nothing moves in the scene, so the targets stay where they are.
+        # They are neither lost nor removed, since they have not been looked
+        # for at all.
+        self.velocities[:] = 0
 
     def get_targets(self):
-        return self.targets.values()
+        return list(self.targets)
+
+    def get_cached(self):
+        # Targets whose label has been stable over the last recognitions with
+        # a high probability are not recognized again. Instead, their labels
+        # are reused for faces detected at about the same place, until the
+        # targets have to be verified by full recognition.
+        min_votes = settings.track_cache_min_votes
+
+        if not self.targets or min_votes > self.TARGET_LABEL_CANDIDATES:
+            return []
+
+        # Last label candidates of each target, from the latest one:
+        pos = (self.label_pos[:, None] - 1 - np.arange(min_votes)) \
+            % self.TARGET_LABEL_CANDIDATES
+        rows = np.arange(len(self.targets))[:, None]
+        recent = self.label_history[rows, pos]
+        stable = (recent == self.label_ids[:, None]).all(axis=1)
+
+        unknown_id = self.label_index.get(settings.clf_unknown_face_label)
+        verify_interval = settings.track_cache_verify_interval
+        cached = (stable
+                  & (self.label_ids != unknown_id)
+                  & (self.probas >= settings.track_cache_confidence)
+                  & (self.cached_frames < verify_interval))
+
+        return [{
+            'label': self.label_names[self.label_ids[i]],
+            'proba': float(self.probas[i]),
+            'box': tuple(self.boxes[i].tolist()),
+        } for i in np.flatnonzero(cached)]
+
+    def predict_rois(self, margin=0.5):
+        # Predict boxes of the targets on the next update by a constant
+        # velocity model, and enlarge them to square regions of interest.
+        boxes = self.boxes + self.velocities
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        sizes = (boxes[:, 2:] - boxes[:, :2]).max(axis=1) * (1 + 2 * margin)
+        half_sizes = sizes[:, None] / 2
+        rois = np.hstack([centers - half_sizes, centers + half_sizes])
+
+        return self.bound_size(np.round(rois)).tolist()
+
+    def confidence(self):
+        # The confidence of tracking is the lowest prediction probability
+        # among the tracked targets. It is zero if nothing is tracked, since
+        # new faces may appear at any moment.
+        if not self.targets:
+            return 0.0
 
-    def update(self, predictions):
-        # If the input list of detected objects is empty, increment lost frame
-        # counter for all of the tracked targets. If number of frames without a
-        # tracked target has exceeded a certain threshold, remove this target
-        # from the tracked ones.
-        if not predictions:
-            lost_targets = []
+        return float(self.probas.min())
 
-            for target_id in self.targets:
-                self.lost_frames[target_id] += 1
+    def match(self, predictions):
+        # Match tracked targets and detected objects by the optimal
+        # assignment, where the cost of a pair is based on overlap of their
+        # boxes. Pairs which do not overlap are matched by distance between
+        # their centroids, unless they are too far from each other.
+        boxes = np.array([p['box'] for p in predictions], dtype=float)
+        iou = box_iou_matrix(self.boxes, boxes)
+        dist = distance.cdist(box_centers(self.boxes), box_centers(boxes))
+        max_dist = self.TARGET_MAX_DISTANCE * np.hypot(*self.img_size)
 
-                if self.lost_frames[target_id] > self.TARGET_LOST_FRAMES:
-                    lost_targets.append(target_id)
+        cost = np.where(iou > 0, 1 - iou, 1 + dist / max_dist)
+        rows, cols = linear_sum_assignment(cost)
+        valid = (iou[rows, cols] > 0) | (dist[rows, cols] <= max_dist)
 
-            for tid in lost_targets:
-                self.remove_target(tid)
+        return rows[valid], cols[valid]
 
+    def update(self, predictions):
+        # If the input list of detected objects is empty, all of the tracked
+        # targets are lost on this frame.
+        if not predictions:
+            self.lose_targets(np.arange(len(self.targets)))
             return self
 
         # If there are no tracked targets, add all the detected objects to the
         # tracked targets.
         if not self.targets:
-
-            for p in predictions:
-                self.add_target(p)
-
+            self.add_targets(predictions)
             return self
 
-        # Perform a match between centroids of bounding boxes of the detected
-        # objects and tracked targets based on the euclidean distance between
-        # them.
-        target_ids, target_centroids = [], []
-
-        for tid, target in self.targets.items():
-            target_ids.append(tid)
-            center = box_center(target.box)
-            target_centroids.append(center)
-
-        target_centroids = np.array(target_centroids)
-        input_centroids = [box_center(p['box']) for p in predictions]
-        input_centroids = np.array(input_centroids)
-
-        dist = distance.cdist(target_centroids, input_centroids)
-
-        # Sort distances between centroids. Here, "rows" is index array of
-        # tracked targets, and "cols" is index array of closest detected
-        # objects.
-        rows = dist.min(axis=1).argsort()
-        cols = dist.argmin(axis=1)[rows]
-
-        used_rows, used_cols = set(), set()
-
-        for row, col in zip(rows, cols):
+        rows, cols = self.match(predictions)
+        self.update_targets(rows, [predictions[c] for c in cols])
 
-            if row in used_rows or col in used_cols:
-                continue
+        # Tracked targets which have not been matched are lost on this frame,
+        # while detected objects which have not been matched become new
+        # targets.
+        unused_rows = np.setdiff1d(np.arange(len(self.targets)), rows)
+        unused_cols = np.setdiff1d(np.arange(len(predictions)), cols)
+        new_targets = [predictions[c] for c in unused_cols]
 
-            # Update the tracked target:
-            target_id = target_ids[row]
-            self.update_target(target_id, predictions[col])
+        self.lose_targets(unused_rows)
 
-            used_rows.add(row)
-            used_cols.add(col)
-
-        unused_rows = set(range(dist.shape[0])).difference(used_rows)
-        unused_cols = set(range(dist.shape[1])).difference(used_cols)
-
-        # If number of tracked targets is greater than the number of detected
-        # objects, update lost frame counters of tracked targets which have not
-        # been found. Otherwise, add new targets to the tracked ones.
-        if dist.shape[0] > dist.shape[1]:
-            lost_targets = []
-
-            for row in unused_rows:
-                target_id = target_ids[row]
-                self.lost_frames[target_id] += 1
-
-                if self.lost_frames[target_id] > self.TARGET_LOST_FRAMES:
-                    lost_targets.append(target_id)
-
-            for tid in lost_targets:
-                self.remove_target(tid)
-
-        else:
-
-            for col in unused_cols:
-                self.add_target(predictions[col])
+        if new_targets:
+            self.add_targets(new_targets)
 
         return self
-
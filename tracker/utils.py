@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def box_center(bbox):
     xmin, ymin, xmax, ymax = bbox
     x = xmin + (xmax - xmin) / 2
@@ -6,6 +9,48 @@ def box_center(bbox):
     return int(x), int(y)
 
 
+def box_centers(boxes):
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+
+    return (boxes[:, :2] + boxes[:, 2:]) / 2
+
+
+def box_iou_matrix(boxes1, boxes2):
+    boxes1 = np.asarray(boxes1, dtype=float).reshape(-1, 1, 4)
+    boxes2 = np.asarray(boxes2, dtype=float).reshape(1, -1, 4)
+
+    w = (np.minimum(boxes1[..., 2], boxes2[..., 2])
+         - np.maximum(boxes1[..., 0], boxes2[..., 0])).clip(min=0)
+    h = (np.minimum(boxes1[..., 3], boxes2[..., 3])
+         - np.maximum(boxes1[..., 1], boxes2[..., 1])).clip(min=0)
+
+    inter = w * h
+    area1 = ((boxes1[..., 2] - boxes1[..., 0])
+             * (boxes1[..., 3] - boxes1[..., 1]))
+    area2 = ((boxes2[..., 2] - boxes2[..., 0])
+             * (boxes2[..., 3] - boxes2[..., 1]))
+    union = area1 + area2 - inter
+
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def box_iou(box1, box2):
+    x1min, y1min, x1max, y1max = box1
+    x2min, y2min, x2max, y2max = box2
+
+    w = min(x1max, x2max) - max(x1min, x2min)
+    h = min(y1max, y2max) - max(y1min, y2min)
+
+    if w <= 0 or h <= 0:
+        return 0.0
+
+    inter = w * h
+    area1 = (x1max - x1min) * (y1max - y1min)
+    area2 = (x2max - x2min) * (y2max - y2min)
+
+    return inter / (area1 + area2 - inter)
+
+
 def overlap(c1min, c1max, c2min, c2max):
     return c1max >= c2min and c2max >= c1min
 
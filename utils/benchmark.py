@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import logging
+import resource
+import platform
+
+import cv2
+import dlib
+import numpy as np
+from PIL import Image
+
+from cfg import settings
+from face.detector import FaceDetection
+from face.recognizer import FaceRecognizer
+from person.detector import PersonDetector
+from tracker import TargetTracker
+
+
+PERCENTILES = (50, 95, 99)
+
+
+def peak_rss():
+    # The peak resident set size of the process (MB). Note that it never
+    # decreases, so it is the peak over all the benchmarks run so far.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Benchmark:
+
+    def __init__(self, repeat=10, warmup=2):
+        self.repeat = repeat
+        self.warmup = warmup
+        self.results = []
+
+    @property
+    def log(self):
+        return logging.getLogger(settings.logger)
+
+    def measure(self, stage, fn, items, **params):
+        # Run the function a few times to warm up caches and lazy
+        # initialization, and then measure latencies of the calls. Each call
+        # processes the given number of items.
+        for _ in range(self.warmup):
+            fn()
+
+        latencies = []
+
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - start)
+
+        latencies = np.array(latencies)
+        result = {
+            'stage': stage,
+            'params': params,
+            'throughput': float(items * len(latencies) / latencies.sum()),
+            **{f'p{p}': float(np.percentile(latencies, p))
+               for p in PERCENTILES},
+            'peak_rss': peak_rss(),
+        }
+        self.results.append(result)
+        self.log.info(f'{stage} {params}: {result["throughput"]:.1f} items/s, '
+                      f'p95 {result["p95"] * 1000:.1f} ms')
+
+        return result
+
+    def report(self):
+        return {
+            'platform': platform.platform(),
+            'versions': {
+                'dlib': dlib.__version__,
+                'opencv': cv2.__version__,
+                'numpy': np.__version__,
+            },
+            'results': self.results,
+        }
+
+    def compare(self, baseline, tolerance=0.1):
+        # Results are matched with the baseline ones by the stage and params.
+        # A result regresses once its throughput drops, or its p95 latency
+        # grows, by more than the tolerance.
+        def key(r):
+            return r['stage'], json.dumps(r['params'], sort_keys=True)
+
+        base_results = {key(r): r for r in baseline['results']}
+        comparison = []
+
+        for r in self.results:
+            base = base_results.get(key(r))
+
+            if base is None:
+                continue
+
+            throughput = r['throughput'] / base['throughput']
+            p95 = r['p95'] / base['p95']
+            comparison.append({
+                'stage': r['stage'],
+                'params': r['params'],
+                'throughput': throughput,
+                'p95': p95,
+                'regression': (throughput < 1 - tolerance
+                               or p95 > 1 + tolerance),
+            })
+
+        return comparison
+
+
+class StageBenchmark(Benchmark):
+
+    STAGES = ('detect', 'align', 'encode', 'classify', 'person', 'track')
+
+    def __init__(self, repeat=10, warmup=2, img_dir=None):
+        super().__init__(repeat, warmup)
+        self.img_files = self.find_images(img_dir) if img_dir else []
+        self.rng = np.random.default_rng(0)
+        self._recognizer = None
+        self._person_detector = None
+
+    @property
+    def recognizer(self):
+
+        if self._recognizer is None:
+            self._recognizer = FaceRecognizer()
+
+        return self._recognizer
+
+    @property
+    def person_detector(self):
+
+        if self._person_detector is None:
+            self._person_detector = PersonDetector()
+
+        return self._person_detector
+
+    def find_images(self, img_dir):
+        exts = ('.jpg', '.jpeg', '.png')
+
+        return sorted(os.path.join(img_dir, f) for f in os.listdir(img_dir)
+                      if f.lower().endswith(exts))
+
+    def images(self, resolution, count):
+        # Sample images are resized to the resolution. Without them, images
+        # of random noise are used, which keeps the detectors busy the same.
+        width, height = resolution
+
+        if not self.img_files:
+            return [self.rng.integers(0, 256, (height, width, 3), np.uint8)
+                    for _ in range(count)]
+
+        return [
+            np.asarray(Image.open(self.img_files[i % len(self.img_files)])
+                       .convert('RGB').resize((width, height)))
+            for i in range(count)
+        ]
+
+    def boxes(self, resolution, count):
+        # Faces are placed on a grid of square cells covering the image.
+        width, height = resolution
+        cols = int(np.ceil(np.sqrt(count)))
+        rows = int(np.ceil(count / cols))
+        size = min(width // cols, height // rows)
+
+        return [[c * size, r * size, (c + 1) * size - 1, (r + 1) * size - 1]
+                for r in range(rows) for c in range(cols)][:count]
+
+    def detections(self, resolution, count):
+        return [FaceDetection(dlib.rectangle(*box), 1.0)
+                for box in self.boxes(resolution, count)]
+
+    def bench_detect(self, resolution, batch_size, faces):
+        images = self.images(resolution, batch_size)
+        detector = self.recognizer.detector
+        self.measure('detect', lambda: detector.detect(images, batch_size),
+                     batch_size, resolution=resolution, batch_size=batch_size)
+
+    def bench_align(self, resolution, batch_size, faces):
+        img = self.images(resolution, 1)[0]
+        dets = self.detections(resolution, faces)
+        aligner = self.recognizer.aligner
+        self.measure('align', lambda: [aligner.align(img, d) for d in dets],
+                     faces, resolution=resolution, faces=faces)
+
+    def bench_encode(self, resolution, batch_size, faces):
+        chips = [self.rng.integers(0, 256, (150, 150, 3), np.uint8)
+                 for _ in range(batch_size)]
+        encoder = self.recognizer.encoder
+        self.measure('encode', lambda: encoder.encode(chips, batch_size),
+                     batch_size, batch_size=batch_size)
+
+    def bench_classify(self, resolution, batch_size, faces):
+        vecs = self.rng.normal(size=(batch_size, 128))
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        clf = self.recognizer.clf
+        self.measure('classify', lambda: clf.predict(vecs, proba=True),
+                     batch_size, batch_size=batch_size)
+
+    def bench_person(self, resolution, batch_size, faces):
+        images = self.images(resolution, batch_size)
+        detector = self.person_detector
+        self.measure('person', lambda: detector.detect(images), batch_size,
+                     resolution=resolution, batch_size=batch_size)
+
+    def bench_track(self, resolution, batch_size, faces):
+        # Targets jitter around their places, so that all of them are
+        # matched on every update.
+        tracker = TargetTracker(resolution)
+        boxes = np.array(self.boxes(resolution, faces))
+
+        def update():
+            jitter = self.rng.integers(-2, 3, boxes.shape)
+            tracker.update([
+                {'label': f'face{i}', 'proba': 0.9, 'box': box.tolist()}
+                for i, box in enumerate(boxes + jitter)
+            ])
+
+        self.measure('track', update, faces, faces=faces)
+
+    def run(self, stages=None, resolutions=((640, 480),), batch_sizes=(1,),
+            face_counts=(1,)):
+        # Each stage is run over the params it depends on only:
+        stage_params = {
+            'detect': ('resolution', 'batch_size'),
+            'align': ('resolution', 'faces'),
+            'encode': ('batch_size',),
+            'classify': ('batch_size',),
+            'person': ('resolution', 'batch_size'),
+            'track': ('faces',),
+        }
+        values = {
+            'resolution': resolutions,
+            'batch_size': batch_sizes,
+            'faces': face_counts,
+        }
+
+        for stage in stages or self.STAGES:
+            bench = getattr(self, f'bench_{stage}')
+            grid = [{}]
+
+            for name in stage_params[stage]:
+                grid = [{**g, name: v} for g in grid for v in values[name]]
+
+            for params in grid:
+                params = {
+                    'resolution': resolutions[0],
+                    'batch_size': batch_sizes[0],
+                    'faces': face_counts[0],
+                    **params,
+                }
+                bench(**params)
+
+        return self.results
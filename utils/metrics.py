@@ -0,0 +1,216 @@
+import logging
+from bisect import bisect_left
+from threading import Thread, Lock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cfg import settings
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+
+    if not pairs:
+        return ''
+
+    labels = ','.join(f'{n}="{v}"' for n, v in pairs)
+
+    return f'{{{labels}}}'
+
+
+class Metric:
+
+    TYPE = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    def key(self, labels):
+        return tuple(str(labels[n]) for n in self.label_names)
+
+    def samples(self):
+
+        with self._lock:
+            return [(self.name, key, [], value)
+                    for key, value in self._values.items()]
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.help}',
+            f'# TYPE {self.name} {self.TYPE}',
+        ]
+
+        for name, key, extra, value in self.samples():
+            labels = format_labels(self.label_names, key, extra)
+            lines.append(f'{name}{labels} {value}')
+
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+
+    TYPE = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self.key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(Metric):
+
+    TYPE = 'gauge'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, func, **labels):
+        # The value is computed by the function once the metrics are
+        # collected, e.g. a size of a queue.
+        key = self.key(labels)
+
+        with self._lock:
+            self._functions[key] = func
+
+    def samples(self):
+        samples = super().samples()
+
+        with self._lock:
+            functions = list(self._functions.items())
+
+        return samples + [(self.name, key, [], func())
+                          for key, func in functions]
+
+
+class Histogram(Metric):
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        # Values are counted per bucket, and made cumulative on collection.
+        key = self.key(labels)
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts, totals = self._values.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0, 0]))
+            counts[index] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def samples(self):
+        samples = []
+
+        with self._lock:
+            values = [(k, list(counts), *totals)
+                      for k, (counts, totals) in self._values.items()]
+
+        for key, counts, total, count in values:
+            cumulative = 0
+
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                samples.append((f'{self.name}_bucket', key,
+                                [('le', bound)], cumulative))
+
+            samples.append((f'{self.name}_sum', key, [], total))
+            samples.append((f'{self.name}_count', key, [], count))
+
+        return samples
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = Lock()
+
+    def register(self, metric_cls, name, *args, **kwargs):
+        # A metric is created once, and then shared by all of its users.
+        with self._lock:
+
+            if name not in self.metrics:
+                self.metrics[name] = metric_cls(name, *args, **kwargs)
+
+            return self.metrics[name]
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram, name, help, labels, buckets)
+
+    def render(self):
+
+        with self._lock:
+            metrics = list(self.metrics.values())
+
+        return '\n'.join(m.render() for m in metrics) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger(settings.logger).debug(format % args)
+
+
+class MetricsServer(Thread):
+
+    def __init__(self, port, host=None):
+        address = (host or settings.metrics_host, port)
+        self.server = ThreadingHTTPServer(address, MetricsRequestHandler)
+        super().__init__(name='MetricsServer', daemon=True)
+
+    @property
+    def log(self):
+        return logging.getLogger(settings.logger)
+
+    def run(self):
+        host, port = self.server.server_address[:2]
+        self.log.info(f'Serve metrics on http://{host}:{port}/metrics')
+        self.server.serve_forever()
+
+    def join(self, timeout=None):
+        self.log.info(f'Stopping {self.name} thread...')
+        self.server.shutdown()
+        self.server.server_close()
+        super().join(timeout)
@@ -0,0 +1,176 @@
+import os
+import sys
+import time
+import pstats
+import logging
+import threading
+from collections import Counter
+from threading import Thread, Event, RLock
+
+from cfg import settings
+
+
+class SamplingProfiler(Thread):
+
+    def __init__(self, duration=None, interval=None, thread_names=None,
+                 output_dir=None):
+        self.duration = duration or settings.profiler_max_duration
+        self.interval = interval or settings.profiler_interval
+        self.thread_names = tuple(thread_names or settings.profiler_threads)
+        self.output_dir = output_dir or settings.profiler_output_dir
+        self.samples = Counter()
+        self.sample_time = self.interval
+        self.stats = {}
+        self.join_event = Event()
+        super().__init__(name='SamplingProfiler', daemon=True)
+
+    @property
+    def log(self):
+        return logging.getLogger(settings.logger)
+
+    def find_threads(self):
+        return {t.ident: t.name for t in threading.enumerate()
+                if t.name.startswith(self.thread_names)}
+
+    def sample(self):
+        # Stacks of the threads are taken from their current frames, so the
+        # threads are neither stopped nor traced between samples.
+        threads = self.find_threads()
+        frames = sys._current_frames()
+
+        for ident, name in threads.items():
+            frame = frames.get(ident)
+            stack = []
+
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno,
+                              code.co_name))
+                frame = frame.f_back
+
+            if stack:
+                self.samples[(name, tuple(reversed(stack)))] += 1
+
+    def run(self):
+        self.log.info(f'Start profiling for {self.duration} sec...')
+        start = time.monotonic()
+        deadline = start + self.duration
+        ticks = 0
+
+        while time.monotonic() < deadline:
+            self.sample()
+            ticks += 1
+
+            if self.join_event.wait(self.interval):
+                break
+
+        # Sampling itself takes time, so a sample stands for the actual
+        # interval between samples rather than the nominal one.
+        self.sample_time = (time.monotonic() - start) / max(ticks, 1)
+        self.dump()
+
+    def create_stats(self):
+        # Sample counts are turned into pstats entries of the form
+        # (primitive calls, calls, total time, cumulative time, callers),
+        # where a function gets the time of a sample per sample.
+        stats = {}
+
+        for (_, stack), count in self.samples.items():
+            t = count * self.sample_time
+            seen = set()
+
+            for i, func in enumerate(stack):
+                entry = stats.setdefault(func, [0, 0, 0.0, 0.0, {}])
+                own = t if i == len(stack) - 1 else 0.0
+                entry[2] += own
+
+                # A recursive function is counted once per sample:
+                if func not in seen:
+                    seen.add(func)
+                    entry[0] += count
+                    entry[1] += count
+                    entry[3] += t
+
+                if i > 0:
+                    caller = entry[4].setdefault(stack[i - 1],
+                                                 [0, 0, 0.0, 0.0])
+                    caller[0] += count
+                    caller[1] += count
+                    caller[2] += own
+                    caller[3] += t
+
+        self.stats = {
+            func: (cc, nc, tt, ct, {c: tuple(v) for c, v in callers.items()})
+            for func, (cc, nc, tt, ct, callers) in stats.items()
+        }
+
+    def collapsed(self):
+        # Stacks in the collapsed format of flame graph tools, rooted at the
+        # thread names.
+        def frame_name(func):
+            filename, line, name = func
+            return f'{name} ({os.path.basename(filename)}:{line})'
+
+        return [
+            ';'.join([thread] + [frame_name(f) for f in stack]) + f' {count}'
+            for (thread, stack), count in self.samples.most_common()
+        ]
+
+    def dump(self):
+
+        if not self.samples:
+            self.log.warning('No threads have been profiled.')
+            return
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = time.strftime('profile-%Y%m%d-%H%M%S')
+        path = os.path.join(self.output_dir, name)
+
+        with open(f'{path}.collapsed', 'w') as f:
+            f.write('\n'.join(self.collapsed()) + '\n')
+
+        pstats.Stats(self).dump_stats(f'{path}.pstats')
+        samples = sum(self.samples.values())
+        self.log.info(f'Save {samples} profile samples to {path}.*')
+
+    def join(self, timeout=None):
+        self.join_event.set()
+        super().join(timeout)
+
+
+class ProfilerSwitch:
+
+    def __init__(self):
+        self.profiler = None
+        # A signal may toggle profiling while it is being started:
+        self._lock = RLock()
+
+    @property
+    def running(self):
+        return self.profiler is not None and self.profiler.is_alive()
+
+    def start(self, duration=None):
+
+        with self._lock:
+
+            if self.running:
+                return
+
+            self.profiler = SamplingProfiler(duration)
+            self.profiler.start()
+
+    def stop(self):
+
+        with self._lock:
+
+            if self.running:
+                self.profiler.join()
+
+            self.profiler = None
+
+    def toggle(self):
+        # Profiling is started or stopped early, e.g. by a signal.
+        if self.running:
+            self.stop()
+        else:
+            self.start()
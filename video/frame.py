@@ -1,10 +1,134 @@
 import os
+import time
 import uuid
 import logging
 from threading import Lock
 
+import cv2
+
 from cfg import settings
-from .stream import VideoStream
+
+
+class Frame:
+
+    CONVERSIONS = {
+        ('bgr', 'rgb'): cv2.COLOR_BGR2RGB,
+        ('rgb', 'bgr'): cv2.COLOR_RGB2BGR,
+        ('bgr', 'gray'): cv2.COLOR_BGR2GRAY,
+        ('rgb', 'gray'): cv2.COLOR_RGB2GRAY,
+    }
+
+    def __init__(self, pixels, layout='bgr', timestamp=None, camera=None,
+                 seq=None):
+        self.layout = layout
+        self.timestamp = timestamp or time.time()
+        self.camera = camera
+        self.seq = seq
+        self._pixels = {layout: pixels}
+        self._overlay = []
+        self._lock = Lock()
+
+    @property
+    def pixels(self):
+
+        with self._lock:
+            return self._pixels[self.layout]
+
+    @property
+    def shape(self):
+        return self.pixels.shape
+
+    def copy(self):
+        # A copy owns its pixels, e.g. to keep a frame of the frame ring once
+        # its slot is reused.
+        with self._lock:
+            pixels = self._pixels[self.layout].copy()
+            overlay = list(self._overlay)
+
+        frame = Frame(pixels, self.layout, self.timestamp, self.camera,
+                      self.seq)
+        frame._overlay = overlay
+
+        return frame
+
+    def convert(self, layout, inplace=False):
+        # Each layout is converted at most once, and then cached. An in-place
+        # conversion reuses the pixel memory instead, so it becomes the only
+        # layout of the frame.
+        with self._lock:
+
+            if layout in self._pixels:
+                return self._pixels[layout]
+
+            src = self._pixels[self.layout]
+            code = self.CONVERSIONS[(self.layout, layout)]
+
+            if inplace:
+                cv2.cvtColor(src, code, dst=src)
+                self.layout = layout
+                self._pixels = {layout: src}
+
+                return src
+
+            dst = cv2.cvtColor(src, code)
+            self._pixels[layout] = dst
+
+            return dst
+
+    def draw_box(self, box, color=(0, 255, 0)):
+        # Overlays are drawn on rendered copies only, so the pixels of the
+        # frame are never changed while being recognized.
+        with self._lock:
+            self._overlay.append((self.render_box, (box, color)))
+
+    def draw_text(self, text, anchor=None, color=(0, 255, 0)):
+
+        with self._lock:
+            self._overlay.append((self.render_text, (text, anchor, color)))
+
+    def render(self, layout='bgr'):
+
+        with self._lock:
+
+            if layout in self._pixels:
+                img = self._pixels[layout].copy()
+            else:
+                code = self.CONVERSIONS[(self.layout, layout)]
+                img = cv2.cvtColor(self._pixels[self.layout], code)
+
+            overlay = list(self._overlay)
+
+        for render, args in overlay:
+            render(img, *args)
+
+        return img
+
+    def show(self, title=None, size=None):
+        img = self.render('bgr')
+
+        if size is not None:
+            img = cv2.resize(img, size)
+
+        cv2.namedWindow(title, cv2.WINDOW_NORMAL)
+        cv2.imshow(title, img)
+
+    def save(self, filename):
+        cv2.imwrite(filename, self.render('bgr'))
+
+    @staticmethod
+    def render_box(img, box, color):
+        xmin, ymin, xmax, ymax = box
+        cv2.rectangle(img, (xmin, ymin), (xmax, ymax), color, thickness=2)
+
+    @staticmethod
+    def render_text(img, text, anchor, color):
+
+        if anchor is None:
+            height = img.shape[0]
+            anchor = (5, height - 5)
+
+        cv2.putText(img, text, anchor, cv2.FONT_HERSHEY_SIMPLEX,
+                    fontScale=1, color=color, thickness=2)
 
 
 class FrameBuffer:
@@ -27,8 +151,8 @@ class FrameBuffer:
         for t in targets:
             text = f'{t.label}: {t.proba:.2f}'
             anchor = (t.box[0], t.box[1] - 5)
-            VideoStream.draw_text(frame, text, anchor)
-            VideoStream.draw_box(frame, t.box)
+            frame.draw_text(text, anchor)
+            frame.draw_box(t.box)
 
         with self._lock:
             self._frames[title] = frame
@@ -39,17 +163,16 @@ class FrameBuffer:
             frames = list(self._frames.items())
 
         for title, frame in frames:
-            VideoStream.show(frame, title)
+            frame.show(title)
 
-        char = VideoStream.wait_key()
+        char = chr(cv2.waitKey(1) & 0xFF)
 
         if char == 'q':
-            VideoStream.close_windows()
+            cv2.destroyAllWindows()
             raise KeyboardInterrupt
 
         if char == 's':
             filename = f'{uuid.uuid4().hex}.jpg'
             filepath = os.path.join(self.img_dir, filename)
-            VideoStream.save(frame, filepath)
+            frame.save(filepath)
             self.log.info(f'Save snapshot to {filepath}')
-
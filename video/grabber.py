@@ -0,0 +1,81 @@
+import time
+import logging
+from threading import Thread, Condition, Event
+
+from cfg import settings
+from utils.metrics import registry
+
+
+FRAMES_DROPPED = registry.counter(
+    'faceid_frames_dropped_total', 'Frames grabbed but never decoded.',
+    ['camera'])
+
+
+class FrameGrabber(Thread):
+
+    def __init__(self, cap, path):
+        self.cap = cap
+        self.path = path
+        self.grabbed = 0
+        self.dropped = 0
+        self._pending = False
+        self._target = None
+        self._result = None
+        self._cond = Condition()
+        self.join_event = Event()
+        super().__init__(name='FrameGrabber', daemon=True)
+
+    @property
+    def log(self):
+        return logging.getLogger(settings.logger)
+
+    def retrieve(self, frame=None, timeout=None):
+        # Wait for the next grabbed frame and decode it into the given array.
+        # Frames grabbed since the previous retrieval are never decoded.
+        with self._cond:
+            self._target = frame
+            self._pending = True
+            self._cond.wait_for(
+                lambda: not self._pending or self.join_event.is_set(), timeout)
+
+            if self._pending:
+                self._pending = False
+                return False, None
+
+            return self._result
+
+    def run(self):
+        self.log.info(f'Start grabbing frames from {self.path}...')
+
+        while not self.join_event.is_set():
+            # Keep grabbing frames, so that the capture buffer never fills up
+            # with stale frames.
+            success = self.cap.grab()
+
+            with self._cond:
+
+                if success:
+                    self.grabbed += 1
+
+                if self._pending:
+                    dropped = max(0, self.grabbed - 1)
+                    self.dropped += dropped
+                    self.grabbed = 0
+                    FRAMES_DROPPED.inc(dropped, camera=self.path)
+                    self._result = (self.cap.retrieve(self._target)
+                                    if success else (False, None))
+                    self._pending = False
+                    self._cond.notify_all()
+
+            if not success:
+                time.sleep(settings.video_grab_retry_interval)
+
+    def join(self, timeout=None):
+        self.log.info(f'Stopping {self.name} thread ({self.path} dropped '
+                      f'{self.dropped} frames)...')
+        self.join_event.set()
+
+        with self._cond:
+            self._cond.notify_all()
+
+        super().join(timeout)
@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+
+from cfg import settings
+
+
+class MotionDetector:
+
+    def __init__(self, sensitivity=0.99, delta=None, width=None, rate=None):
+        # A frame is considered moving once the fraction of its changed
+        # pixels exceeds 1 - sensitivity.
+        self.min_area = 1 - sensitivity
+        self.delta = delta or settings.motion_pixel_delta
+        self.width = width or settings.motion_frame_width
+        self.rate = rate or settings.motion_background_rate
+        self.background = None
+
+    def preprocess(self, frame):
+        # Frames are downscaled before the conversion to grayscale:
+        pixels = frame.pixels
+        h, w = pixels.shape[:2]
+        size = (self.width, max(1, round(h * self.width / w)))
+        small = cv2.resize(pixels, size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, frame.CONVERSIONS[(frame.layout, 'gray')])
+
+        return cv2.GaussianBlur(gray, (5, 5), 0).astype(np.float32)
+
+    def detect(self, frame):
+        # Frames are compared with a running average background, so that
+        # slow changes of lighting are absorbed instead of counted as motion.
+        gray = self.preprocess(frame)
+
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            return True
+
+        diff = cv2.absdiff(gray, self.background)
+        cv2.accumulateWeighted(gray, self.background, self.rate)
+        changed = np.count_nonzero(diff > self.delta) / diff.size
+
+        return changed >= self.min_area
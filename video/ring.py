@@ -0,0 +1,94 @@
+import time
+from threading import Lock
+
+import numpy as np
+
+
+class FrameRing:
+
+    def __init__(self, shape, slots=8, dtype=np.uint8):
+        self.slots = slots
+        self.frames = np.zeros((slots, *shape), dtype)
+        self.seqs = np.full(slots, -1, dtype=np.int64)
+        self.timestamps = np.zeros(slots)
+        self.pins = np.zeros(slots, dtype=np.int32)
+        self.seq = -1
+        self._index = -1
+        self._lock = Lock()
+
+    @property
+    def shape(self):
+        return self.frames.shape[1:]
+
+    def acquire(self):
+        # Take the next slot for writing skipping the ones pinned by readers,
+        # or None if all of them are pinned. The slot is invalidated until a
+        # new frame is committed to it.
+        with self._lock:
+
+            for i in range(1, self.slots + 1):
+                index = (self._index + i) % self.slots
+
+                if not self.pins[index]:
+                    self.seqs[index] = -1
+                    self._index = index
+
+                    return index
+
+    def commit(self, index, timestamp=None):
+
+        with self._lock:
+            self.seq += 1
+            self.seqs[index] = self.seq
+            self.timestamps[index] = timestamp or time.time()
+
+            return self.seq
+
+    def _find(self, seq):
+        indices = np.flatnonzero(self.seqs == seq)
+
+        return indices[0] if len(indices) else None
+
+    def get(self, seq):
+
+        with self._lock:
+            index = self._find(seq)
+
+            if index is None:
+                return
+
+            return self.frames[index]
+
+    def latest(self):
+        return self.get(self.seq)
+
+    def timestamp(self, seq):
+
+        with self._lock:
+            index = self._find(seq)
+
+            if index is None:
+                return
+
+            return self.timestamps[index]
+
+    def pin(self, seq):
+        # A pinned frame is not overwritten until it is unpinned, so it can be
+        # read without copying for as long as needed.
+        with self._lock:
+            index = self._find(seq)
+
+            if index is None:
+                return False
+
+            self.pins[index] += 1
+
+            return True
+
+    def unpin(self, seq):
+
+        with self._lock:
+            index = self._find(seq)
+
+            if index is not None and self.pins[index]:
+                self.pins[index] -= 1
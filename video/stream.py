@@ -1,18 +1,60 @@
+import time
+
 import cv2
+import numpy as np
+
+from cfg import settings
+from .frame import Frame
+from .grabber import FrameGrabber, FRAMES_DROPPED
+from .ring import FrameRing
 
 
 class VideoStream:
 
-    def __init__(self, path='/dev/video0', size=(640, 480)):
+    REDUCED_DECODE_FLAGS = {
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8,
+    }
+
+    def __init__(self, path='/dev/video0', size=(640, 480), ring_slots=None,
+                 detection=None, motion=None, capture=None, mjpeg=None):
         self.path = path
         self.size = size
+        self.detection = detection
+        self.motion = motion
+        self.mjpeg = settings.video_raw_mjpeg if mjpeg is None else mjpeg
         self.cap = self.capture_stream()
+        self.grabber = None
+
+        if (capture or settings.video_capture_mode) == 'latest':
+            self.grabber = FrameGrabber(self.cap, path)
+            self.grabber.start()
+
+        width, height = size
+        self.ring = FrameRing((height, width, 3),
+                              ring_slots or settings.video_ring_slots)
+        self.seq = None
+        self.timestamp = None
+        self.jpeg = None
+        self.index = None
+        self.decoded = {}
 
     def __del__(self):
+        self.close()
+
+    def close(self):
+        grabber = getattr(self, 'grabber', None)
+
+        if grabber is not None:
+            grabber.join()
+            self.grabber = None
+
         cap = getattr(self, 'cap', None)
 
         if cap is not None:
             cap.release()
+            self.cap = None
 
     def capture_stream(self):
         cap = cv2.VideoCapture(self.path)
@@ -24,54 +66,105 @@ class VideoStream:
             cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
             cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
+            if self.mjpeg:
+                # Pass MJPEG frames through undecoded:
+                cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+
         return cap
 
     def read(self):
-        success, frame = self.cap.read()
+        # Capture a frame and decode it at full resolution:
+        if not self.grab():
+            return
+
+        return self.decode()
+
+    def grab(self):
+        # Capture a frame right into a preallocated slot of the frame ring.
+        # Raw MJPEG frames are kept encoded until they are decoded on demand.
+        index = self.ring.acquire()
+        slot = None if self.mjpeg or index is None else self.ring.frames[index]
+
+        if self.grabber is not None:
+            success, pixels = self.grabber.retrieve(slot)
+        else:
+            success, pixels = self.cap.read(slot)
 
         if not success:
-            return
+            return False
 
-        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        self.timestamp = time.time()
+        self.decoded = {}
 
-    @staticmethod
-    def draw_box(frame, box, color=(0, 255, 0)):
-        xmin, ymin, xmax, ymax = box
-        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), color, thickness=2)
+        # All slots are pinned by readers, so the frame is dropped, i.e. it is
+        # grabbed to keep the capture fresh, but never decoded.
+        if index is None:
+            self.jpeg = None
+            self.seq = None
+            FRAMES_DROPPED.inc(camera=self.path)
 
-    @staticmethod
-    def draw_text(frame, text, anchor=None, color=(0, 255, 0)):
+            return True
 
-        if anchor is None:
-            height = frame.shape[0]
-            anchor = (5, height - 5)
+        # The device may ignore the raw mode and return decoded frames:
+        if pixels.ndim < 3:
+            self.jpeg = pixels
+            self.index = index
+            self.seq = None
+        else:
+            self.jpeg = None
+            self.decoded[1] = self.commit(index, pixels)
 
-        cv2.putText(frame, text, anchor, cv2.FONT_HERSHEY_SIMPLEX,
-                    fontScale=1, color=color, thickness=2)
+        return True
 
-    @staticmethod
-    def show(frame, title=None, size=None):
+    def decode(self, scale=1):
+        # Decode the last grabbed frame at 1/scale of its resolution. A frame
+        # of the full resolution is decoded into the frame ring, while JPEG
+        # frames of a reduced scale are decoded right in the DCT domain.
+        if self.jpeg is None:
+            return self.decoded.get(1)
 
-        if frame is None:
-            return
+        if scale in self.decoded:
+            return self.decoded[scale]
+
+        frame = None
+
+        if scale == 1:
+            pixels = cv2.imdecode(self.jpeg, cv2.IMREAD_COLOR)
+
+            if pixels is not None:
+                frame = self.commit(self.index, pixels)
+        else:
+            pixels = cv2.imdecode(self.jpeg, self.REDUCED_DECODE_FLAGS[scale])
+
+            if pixels is not None:
+                frame = Frame(pixels, 'bgr', self.timestamp, self.path)
+
+        self.decoded[scale] = frame
+
+        return frame
+
+    def reduced_scale(self, width):
+        # The largest decode scale keeping frames at least of the given width:
+        frame_width = self.ring.shape[1]
 
-        if size is not None:
-            frame = cv2.resize(frame, size)
+        return max(s for s in (1, *self.REDUCED_DECODE_FLAGS)
+                   if frame_width // s >= width)
 
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        cv2.namedWindow(title, cv2.WINDOW_NORMAL)
-        cv2.imshow(title, frame)
+    def commit(self, index, pixels):
+        slot = self.ring.frames[index]
 
-    @staticmethod
-    def save(frame, filename):
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        cv2.imwrite(filename, frame)
+        if pixels.shape != slot.shape:
+            # The device does not support the requested resolution, so the
+            # frame ring is reallocated to fit the actual frame size.
+            self.ring = FrameRing(pixels.shape, self.ring.slots)
+            index = self.ring.acquire()
+            slot = self.ring.frames[index]
 
-    @staticmethod
-    def wait_key(timeout=1):
-        return chr(cv2.waitKey(timeout) & 0xFF)
+        if not np.shares_memory(pixels, slot):
+            slot[:] = pixels
 
-    @staticmethod
-    def close_windows():
-        cv2.destroyAllWindows()
+        # Frames are kept in the capture layout, and converted only once
+        # they are recognized or shown.
+        self.seq = self.ring.commit(index, self.timestamp)
 
+        return Frame(slot, 'bgr', self.timestamp, self.path, self.seq)
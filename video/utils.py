@@ -14,8 +14,14 @@ def create_stream(conf_file, configure=False):
 
     path = cfg['path']
     size = tuple(cfg['resolution'])
-
-    return VideoStream(path, size)
+    ring_slots = cfg.get('ring_slots')
+    detection = cfg.get('detection')
+    motion = cfg.get('motion')
+    capture = cfg.get('capture')
+    mjpeg = cfg.get('mjpeg')
+
+    return VideoStream(path, size, ring_slots, detection, motion, capture,
+                       mjpeg)
 
 
 def apply_device_settings(cfg, reset=False):
@@ -0,0 +1,86 @@
+import time
+import queue
+from threading import Lock
+from collections import deque
+
+import numpy as np
+
+from cfg import settings
+
+
+class AdaptiveBatcher:
+
+    LATENCY_WINDOW = 100
+    LATENCY_PERCENTILE = 95
+
+    def __init__(self, task_queue, max_size=32, latency_target=None,
+                 max_wait=None, min_size=1):
+        self.task_queue = task_queue
+        self.max_size = max_size
+        self.min_size = min(min_size, max_size)
+        self.latency_target = latency_target or settings.batch_latency_target
+
+        if max_wait is None:
+            max_wait = settings.batch_max_wait
+
+        self.max_wait = max_wait
+        self.item_latencies = deque(maxlen=self.LATENCY_WINDOW)
+        self.batch_size = max_size
+        self.backlog_size = 1
+        self._lock = Lock()
+
+    def observe(self, size, latency):
+        # Estimate a per-item processing latency from observed batches, and
+        # choose the largest batch which is still expected to be processed
+        # within the latency target.
+        with self._lock:
+            self.item_latencies.append(latency / size)
+            item_latency = np.percentile(self.item_latencies,
+                                         self.LATENCY_PERCENTILE)
+            size = int(self.latency_target / max(item_latency, 1e-6))
+            self.batch_size = max(self.min_size, min(self.max_size, size))
+
+    def next_batch(self, timeout=None):
+
+        try:
+            tasks = [self.task_queue.get(True, timeout)]
+        except queue.Empty:
+            return []
+
+        # While the backlog exceeds the batch size, queued tasks wait longer
+        # than a batch is processed anyway, so batches grow towards the max
+        # size to drain the queue at a higher throughput. Once the backlog is
+        # drained, batches are bound by the latency target again.
+        backlog = self.task_queue.qsize() + 1
+
+        with self._lock:
+
+            if backlog > self.backlog_size:
+                self.backlog_size = min(self.max_size,
+                                        max(self.batch_size,
+                                            2 * self.backlog_size))
+            else:
+                self.backlog_size = self.batch_size
+
+            batch_size = self.backlog_size
+
+        # Take tasks which are already queued without waiting. If the queue
+        # runs out, wait for more tasks within a short micro-batching window.
+        deadline = time.monotonic() + self.max_wait
+
+        while len(tasks) < batch_size:
+            wait = deadline - time.monotonic()
+
+            try:
+
+                if wait > 0:
+                    task = self.task_queue.get(True, wait)
+                else:
+                    task = self.task_queue.get_nowait()
+
+            except queue.Empty:
+                break
+
+            tasks.append(task)
+
+        return tasks
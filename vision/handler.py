@@ -1,55 +1,106 @@
-import queue
+import time
 import logging
 from threading import Thread, Event
 
 from cfg import settings
+from utils.metrics import registry, SIZE_BUCKETS
+from .batcher import AdaptiveBatcher
 from .predictor.factory import PredictorFactory
 
 
+QUEUE_DEPTH = registry.gauge(
+    'faceid_task_queue_depth', 'Vision tasks waiting for a handler.')
+BATCH_SIZE = registry.histogram(
+    'faceid_batch_size', 'Vision tasks per batch.', buckets=SIZE_BUCKETS)
+BATCH_LATENCY = registry.histogram(
+    'faceid_batch_latency_seconds', 'Latency of a vision task batch.')
+TASK_ERRORS = registry.counter(
+    'faceid_task_errors_total', 'Vision tasks which failed.')
+
+
 class VisionTaskHandler(Thread):
 
     QUEUE_GET_TIMEOUT = 5
 
-    def __init__(self, name, task_queue, batch_size=32):
-        self.predictor = PredictorFactory.build(name)
+    def __init__(self, name, task_queue, batch_size=32, latency_target=None):
+        self.predictor = self.build_predictor(name)
         self.task_queue = task_queue
         self.batch_size = batch_size
+        self.batcher = AdaptiveBatcher(task_queue, batch_size, latency_target)
         self.join_event = Event()
+        QUEUE_DEPTH.set_function(task_queue.qsize)
         super().__init__(name='VisionTaskHandler')
 
     @property
     def log(self):
         return logging.getLogger(settings.logger)
 
+    def build_predictor(self, name):
+        return PredictorFactory.build(name)
+
+    def model_files(self):
+        return self.predictor.model_files()
+
+    def reload(self):
+        self.predictor.reload()
+
+    def batch_params(self, tasks):
+        # Parameters of tasks, e.g. hints of a tracker, are passed to the
+        # predictor as lists of values per image.
+        keys = {k for t in tasks for k in t.params}
+
+        return {k: [t.params.get(k) for t in tasks] for k in keys}
+
+    def next_batch(self):
+        return self.batcher.next_batch(self.QUEUE_GET_TIMEOUT)
+
+    def handle(self, tasks):
+        images = [t.image for t in tasks]
+        params = self.batch_params(tasks)
+        start = time.monotonic()
+
+        try:
+            predictions = self.predictor.predict(images, self.batch_size,
+                                                 **params)
+        except Exception as e:
+            self.log.exception('Failed to handle vision tasks.')
+            self.fail(tasks, e)
+            return
+
+        self.observe(len(tasks), time.monotonic() - start)
+        self.complete(tasks, predictions)
+
+    def observe(self, size, latency):
+        self.batcher.observe(size, latency)
+        BATCH_LATENCY.observe(latency)
+
+    def complete(self, tasks, predictions):
+
+        for i, task in enumerate(tasks):
+            task.set_results(predictions[i])
+            self.task_queue.task_done()
+
+    def fail(self, tasks, error):
+        TASK_ERRORS.inc(len(tasks))
+
+        for task in tasks:
+            task.set_error(error)
+            self.task_queue.task_done()
+
     def run(self):
         self.log.info('Start handling vision tasks...')
 
         while not self.join_event.is_set():
-            tasks = []
-            block = True
-
-            for _ in range(self.batch_size):
-
-                try:
-                    task = self.task_queue.get(block, self.QUEUE_GET_TIMEOUT)
-                    tasks.append(task)
-                    block = False
-                except queue.Empty:
-                    break
+            tasks = self.next_batch()
 
             if not tasks:
                 continue
 
-            images = [t.image for t in tasks]
-            predictions = self.predictor.predict(images, self.batch_size)
-
-            for i, task in enumerate(tasks):
-                task.results = predictions[i]
-                self.task_queue.task_done()
+            BATCH_SIZE.observe(len(tasks))
+            self.handle(tasks)
 
     def join(self, timeout=None):
         self.log.info(f'Stopping {self.name} thread...')
         self.task_queue.join()
         self.join_event.set()
         super().join(timeout)
-
@@ -0,0 +1,138 @@
+import time
+import queue
+import logging
+from threading import Thread, Event, Lock
+from contextlib import nullcontext
+
+from cfg import settings
+from utils.metrics import registry
+from .handler import VisionTaskHandler
+from .predictor.abc import STAGE_LATENCY
+
+
+STAGE_QUEUE_DEPTH = registry.gauge(
+    'faceid_stage_queue_depth', 'Batches waiting for a pipeline stage.',
+    ['stage'])
+
+
+class PipelineStage(Thread):
+
+    QUEUE_GET_TIMEOUT = 1
+
+    def __init__(self, name, func, in_queue, out_queue=None, lock=None):
+        self.stage = name
+        self.func = func
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.lock = lock or nullcontext()
+        self.join_event = Event()
+        super().__init__(name=f'PipelineStage-{name}')
+
+    @property
+    def log(self):
+        return logging.getLogger(settings.logger)
+
+    def run(self):
+
+        while not self.join_event.is_set():
+
+            try:
+                state = self.in_queue.get(True, self.QUEUE_GET_TIMEOUT)
+            except queue.Empty:
+                continue
+
+            # A batch which failed on one of the previous stages is passed
+            # through up to the final stage, which fails its tasks.
+            if 'error' not in state or self.out_queue is None:
+
+                try:
+
+                    with self.lock:
+                        start = time.monotonic()
+                        state = self.func(state)
+                        latency = time.monotonic() - start
+                        STAGE_LATENCY.observe(latency, stage=self.stage)
+                        # Time spent waiting in the stage queues is not
+                        # counted as processing time of the batch.
+                        state['processing'] = (state.get('processing', 0)
+                                               + latency)
+
+                except Exception as e:
+                    self.log.exception(f'{self.name} failed.')
+                    state['error'] = e
+
+            if self.out_queue is not None:
+                self.out_queue.put(state)
+
+            self.in_queue.task_done()
+
+    def join(self, timeout=None):
+        self.join_event.set()
+        super().join(timeout)
+
+
+class StagedTaskHandler(VisionTaskHandler):
+
+    def __init__(self, name, task_queue, batch_size=32, latency_target=None,
+                 workers=None):
+        super().__init__(name, task_queue, batch_size, latency_target)
+        self.workers = workers or settings.pipeline_stage_workers
+        self.stage_queues = []
+        self.stage_threads = []
+        self.build_stages()
+
+    def build_stages(self):
+        # Predictor stages are connected by bounded queues, so different
+        # batches are processed by different stages at the same time. The
+        # final stage sets results of the batch tasks.
+        stages = self.predictor.stages() + [('complete', self.complete_stage)]
+        queue_size = settings.pipeline_queue_size
+        in_queue = queue.Queue(queue_size)
+
+        for i, (name, func) in enumerate(stages):
+            last = i == len(stages) - 1
+            out_queue = None if last else queue.Queue(queue_size)
+            lock = Lock() if name in self.predictor.EXCLUSIVE_STAGES else None
+            self.stage_queues.append(in_queue)
+            STAGE_QUEUE_DEPTH.set_function(in_queue.qsize, stage=name)
+
+            for _ in range(self.workers.get(name, 1)):
+                t = PipelineStage(name, func, in_queue, out_queue, lock)
+                self.stage_threads.append(t)
+
+            in_queue = out_queue
+
+    def complete_stage(self, state):
+        tasks = state['tasks']
+        error = state.get('error')
+
+        if error is not None:
+            self.fail(tasks, error)
+        else:
+            self.observe(len(tasks), state.get('processing', 0))
+            self.complete(tasks, state['predictions'])
+
+        return state
+
+    def handle(self, tasks):
+        state = {
+            'tasks': tasks,
+            'images': [t.image for t in tasks],
+            'batch_size': self.batch_size,
+            'processing': 0,
+        }
+        state.update(self.batch_params(tasks))
+        self.stage_queues[0].put(state)
+
+    def start(self):
+
+        for t in self.stage_threads:
+            t.start()
+
+        super().start()
+
+    def join(self, timeout=None):
+        super().join(timeout)
+
+        for t in self.stage_threads:
+            t.join(timeout)
@@ -1,9 +1,37 @@
 from abc import ABC, abstractmethod
 
+from utils.metrics import registry
+
+
+STAGE_LATENCY = registry.histogram(
+    'faceid_stage_latency_seconds', 'Latency of a pipeline stage per batch.',
+    ['stage'])
+
 
 class Predictor(ABC):
 
+    # Stages which must not run concurrently, e.g. because an underlying
+    # model keeps its state between calls:
+    EXCLUSIVE_STAGES = ()
+
     @abstractmethod
     def predict(self, images, **kwargs):
         raise NotImplementedError
 
+    def model_files(self):
+        # Files which are watched by a model reloader.
+        return []
+
+    def reload(self):
+        pass
+
+    def stages(self):
+        # A predictor is split into a sequence of named stages run one after
+        # another by a staged pipeline. Each stage takes a batch state dict
+        # and returns it updated. The final stage sets "predictions".
+        return [('predict', self.predict_stage)]
+
+    def predict_stage(self, state):
+        state['predictions'] = self.predict(state['images'])
+
+        return state
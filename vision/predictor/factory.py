@@ -1,3 +1,4 @@
+from face.gated import PersonGatedRecognizer
 from face.recognizer import FaceRecognizer
 from person.detector import PersonDetector
 
@@ -9,6 +10,8 @@ class PredictorFactory:
 
         if name == 'face':
             predictor = FaceRecognizer()
+        elif name == 'person_face':
+            predictor = PersonGatedRecognizer()
         elif name == 'person':
             predictor = PersonDetector()
         else:
@@ -0,0 +1,261 @@
+import time
+import logging
+import multiprocessing as mp
+from threading import Event
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from cfg import settings
+from .handler import VisionTaskHandler
+from .predictor.factory import PredictorFactory
+
+
+def pack_predictions(predictions):
+    # Pack predictions of a batch into a few flat arrays instead of pickling
+    # a dict per object. Objects of the i-th image are selected by counts.
+    objects = [p for image_preds in predictions for p in image_preds]
+
+    return {
+        'counts': np.array([len(p) for p in predictions], dtype=np.int32),
+        'labels': np.array([p['label'] for p in objects], dtype=np.str_),
+        'probas': np.array([p['proba'] for p in objects], dtype=np.float32),
+        'boxes': np.array([p['box'] for p in objects],
+                          dtype=np.int32).reshape(-1, 4),
+        'cached': np.array([p.get('cached', False) for p in objects],
+                           dtype=bool),
+    }
+
+
+def unpack_predictions(packed):
+    predictions = []
+    start = 0
+
+    for count in packed['counts']:
+        end = start + count
+        image_preds = []
+
+        for label, proba, box, cached in zip(packed['labels'][start:end],
+                                             packed['probas'][start:end],
+                                             packed['boxes'][start:end],
+                                             packed['cached'][start:end]):
+            pred = {
+                'label': str(label),
+                'proba': float(proba),
+                'box': box.tolist(),
+            }
+
+            if cached:
+                pred['cached'] = True
+
+            image_preds.append(pred)
+
+        predictions.append(image_preds)
+        start = end
+
+    return predictions
+
+
+def run_worker(name, shm_name, conn):
+    log = logging.getLogger(settings.logger)
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    try:
+        predictor = PredictorFactory.build(name)
+        conn.send({'model_files': predictor.model_files()})
+    except Exception as e:
+        conn.send({'error': RuntimeError(f'Failed to build predictor: {e}')})
+        shm.close()
+        return
+
+    while True:
+        request = conn.recv()
+
+        if request is None:
+            break
+
+        # Models are reloaded between batches, and the model files are sent
+        # back once the new models are in use.
+        if request.get('reload'):
+
+            try:
+                predictor.reload()
+                conn.send({'model_files': predictor.model_files()})
+            except Exception as e:
+                log.exception('Failed to reload models.')
+                conn.send({'error': RuntimeError(str(e))})
+
+            continue
+
+        # Frames are read right from the shared memory slots, no copy.
+        images = [
+            np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+            for offset, shape, dtype in request['frames']
+        ]
+
+        try:
+            predictions = predictor.predict(images, request['batch_size'],
+                                            **request['params'])
+            response = {'predictions': pack_predictions(predictions)}
+        except Exception as e:
+            log.exception('Failed to handle vision tasks.')
+            response = {'error': RuntimeError(str(e))}
+
+        del images
+        conn.send(response)
+
+    shm.close()
+
+
+class ProcessTaskHandler(VisionTaskHandler):
+
+    def __init__(self, name, task_queue, batch_size=32, latency_target=None):
+        super().__init__(name, task_queue, batch_size, latency_target)
+        self.predictor_name = name
+        self.slot_size = settings.process_frame_slot_size
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=batch_size * self.slot_size)
+        # A worker process owns its own models. Use the spawn start method,
+        # since forking a process with initialized CUDA is not safe.
+        self.ctx = mp.get_context('spawn')
+        self.reload_event = Event()
+        self._model_files = []
+        self.conn = None
+        self.worker = None
+
+    def build_predictor(self, name):
+        # Models are loaded by the worker process.
+        return None
+
+    def spawn_worker(self):
+        # A worker gets a new connection on each spawn, and reports the model
+        # files once its predictor is built. The shared memory is reused.
+        self.conn, worker_conn = self.ctx.Pipe()
+        self.worker = self.ctx.Process(target=run_worker,
+                                       args=(self.predictor_name,
+                                             self.shm.name, worker_conn),
+                                       name='VisionTaskWorker',
+                                       daemon=True)
+        self.worker.start()
+        worker_conn.close()
+        response = self.conn.recv()
+
+        if 'error' in response:
+            self.worker.join()
+            raise response['error']
+
+        self._model_files = response['model_files']
+
+    def respawn_worker(self):
+        self.log.warning(f'{self.worker.name} exited with code '
+                         f'{self.worker.exitcode}, respawning...')
+        self.conn.close()
+        self.worker.join(0)
+        self.reload_event.clear()
+        self.spawn_worker()
+
+    def model_files(self):
+        return self._model_files
+
+    def reload(self):
+        # The worker is asked to reload models right before the next batch,
+        # since its connection is used by the handler thread only.
+        self.reload_event.set()
+
+    def request_reload(self):
+        self.reload_event.clear()
+        self.conn.send({'reload': True})
+        response = self.conn.recv()
+
+        # The worker keeps handling batches with the current models:
+        if 'error' in response:
+            self.log.error(f'Failed to reload models: {response["error"]}')
+            return
+
+        self._model_files = response['model_files']
+
+    def write_frames(self, images):
+        frames = []
+
+        for i, img in enumerate(images):
+
+            if img.nbytes > self.slot_size:
+                raise ValueError(f'Frame of shape {img.shape} exceeds '
+                                 f'the shared memory slot size, set '
+                                 f'process_frame_slot_size to at least '
+                                 f'{img.nbytes} bytes.')
+
+            offset = i * self.slot_size
+            slot = np.ndarray(img.shape, img.dtype,
+                              buffer=self.shm.buf, offset=offset)
+            slot[:] = img
+            frames.append((offset, img.shape, img.dtype.str))
+
+        return frames
+
+    def handle(self, tasks):
+        start = time.monotonic()
+
+        try:
+
+            # A crashed worker, e.g. killed by the OOM killer, is replaced
+            # before the batch is sent. Its models are loaded again, so the
+            # reload is not needed anymore.
+            if not self.worker.is_alive():
+                self.respawn_worker()
+
+            if self.reload_event.is_set():
+                self.request_reload()
+
+            frames = self.write_frames([t.image for t in tasks])
+            self.conn.send({
+                'frames': frames,
+                'params': self.batch_params(tasks),
+                'batch_size': self.batch_size,
+            })
+            response = self.conn.recv()
+
+            if 'error' in response:
+                raise response['error']
+
+        except (EOFError, OSError) as e:
+            # The connection to the worker is broken, so the batch fails,
+            # and the next one is handled by a new worker.
+            self.log.exception('Lost connection to the vision task worker.')
+            self.fail(tasks, e)
+            self.worker.terminate()
+            self.worker.join()
+            return
+
+        except Exception as e:
+            self.log.exception('Failed to handle vision tasks.')
+            self.fail(tasks, e)
+            return
+
+        predictions = unpack_predictions(response['predictions'])
+        self.observe(len(tasks), time.monotonic() - start)
+        self.complete(tasks, predictions)
+
+    def start(self):
+        self.log.info(f'Shared memory slots fit RGB frames of up to '
+                      f'{self.slot_size // 3} pixels, set '
+                      f'process_frame_slot_size for larger frames.')
+
+        try:
+            self.spawn_worker()
+        except Exception:
+            self.shm.close()
+            self.shm.unlink()
+            raise
+
+        super().start()
+
+    def join(self, timeout=None):
+        super().join(timeout)
+
+        if self.worker is not None and self.worker.is_alive():
+            self.conn.send(None)
+            self.worker.join(timeout)
+
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,69 @@
+import os
+import logging
+from threading import Thread, Event
+
+from cfg import settings
+
+
+class ModelReloader(Thread):
+
+    def __init__(self, handlers, interval=None):
+        self.handlers = handlers
+        self.interval = interval or settings.model_reload_interval
+        self.mtimes = {}
+        self.join_event = Event()
+        super().__init__(name='ModelReloader')
+
+    @property
+    def log(self):
+        return logging.getLogger(settings.logger)
+
+    def get_mtimes(self):
+        mtimes = {}
+
+        for path in self.handlers[0].model_files():
+
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                pass
+
+        return mtimes
+
+    def run(self):
+        self.mtimes = self.get_mtimes()
+        changed = None
+
+        while not self.join_event.wait(self.interval):
+
+            try:
+                mtimes = self.get_mtimes()
+            except Exception as e:
+                self.log.warning(f'Failed to check model files: {e}')
+                continue
+
+            if mtimes == self.mtimes:
+                changed = None
+                continue
+
+            # Wait until model files stop changing, so that files which are
+            # still being copied are not loaded.
+            if mtimes != changed:
+                changed = mtimes
+                continue
+
+            self.log.info('Model files have changed, reload models...')
+            self.mtimes = mtimes
+            changed = None
+
+            for h in self.handlers:
+
+                try:
+                    h.reload()
+                except Exception:
+                    self.log.exception('Failed to reload models.')
+
+    def join(self, timeout=None):
+        self.log.info(f'Stopping {self.name} thread...')
+        self.join_event.set()
+        super().join(timeout)
@@ -1,25 +1,40 @@
-from threading import Condition
+from threading import Event
 
 
 class VisionTask:
 
-    def __init__(self, image=None):
+    def __init__(self, image=None, **params):
         self.image = image
-        self.done = Condition()
+        self.params = params
+        self._done = Event()
         self._results = None
+        self._error = None
 
-    @property
-    def results(self):
+    def done(self):
+        return self._done.is_set()
 
-        with self.done:
-            self.done.wait()
+    def set_results(self, predictions):
+        self._results = predictions
+        self._done.set()
 
-            return self._results
+    def set_error(self, error):
+        self._error = error
+        self._done.set()
 
-    @results.setter
-    def results(self, predictions):
+    def get_results(self, timeout=None):
+
+        if not self._done.wait(timeout):
+            raise TimeoutError('Vision task is not done yet.')
+
+        if self._error is not None:
+            raise self._error
 
-        with self.done:
-            self._results = predictions
-            self.done.notify()
+        return self._results
 
+    @property
+    def results(self):
+        return self.get_results()
+
+    @results.setter
+    def results(self, predictions):
+        self.set_results(predictions)